@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Async Gmail Sender
+asyncio sending engine that keeps many messages().send calls in flight
+"""
+
+import asyncio
+import json
+import ssl
+import urllib.parse
+
+import httplib2
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+
+from email_templates import load_template
+from gmail_metrics import phase
+from gmail_rate_limiter import (
+    QUOTA_UNITS, RateLimiter, backoff_delay, retry_after_seconds, throttle_delay)
+from gmail_retry import (
+    PERMANENT, THROTTLED, TRANSIENT, RetryPolicy, classify, oauth_breaker, refresh_credentials)
+from send_gmail_oauth import create_message
+
+# Gmail API scope for sending emails
+SCOPES = ['https://www.googleapis.com/auth/gmail.send']
+
+API_ROOT = 'https://gmail.googleapis.com/'
+
+# Upper bound on concurrent sends, and so on open connections
+DEFAULT_MAX_IN_FLIGHT = 100
+
+# Seconds allowed for a single send, including waiting for a connection
+DEFAULT_TIMEOUT = 30
+
+def load_credentials(token_path='token.json'):
+    """Load OAuth credentials saved by the other sender scripts"""
+    return Credentials.from_authorized_user_file(token_path, SCOPES)
+
+# Statuses whose responses never carry a body, whatever their headers say
+BODILESS_STATUSES = (204, 304)
+
+async def _read_head(reader):
+    """Read a status line and headers and return (status, headers)"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('Connection closed before a response was received')
+    status = int(status_line.split(b' ', 2)[1])
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return status, headers
+
+async def _read_response(reader):
+    """Read one HTTP/1.1 response and return (status, headers, body)
+
+    Interim 1xx responses (e.g. 100 Continue) are skipped.
+    """
+    status, headers = await _read_head(reader)
+    while 100 <= status < 200:
+        status, headers = await _read_head(reader)
+
+    if status in BODILESS_STATUSES:
+        body = b''
+    elif headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # Skip any trailers up to the terminating blank line
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        body = b''.join(chunks)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body = await reader.read()
+        headers['connection'] = 'close'
+
+    return status, headers, body
+
+class AsyncGmailSender:
+    """Send prepared messages from an asyncio event loop
+
+    Requests go over a pool of keep-alive HTTP/1.1 connections opened with
+    asyncio streams, so hundreds of sends can be in flight without a thread
+    per send. A semaphore bounds concurrency, every send has its own timeout,
+    and cancelling a send closes the connection it was using.
+    """
+
+    def __init__(self, credentials, max_in_flight=DEFAULT_MAX_IN_FLIGHT,
+                 timeout=DEFAULT_TIMEOUT, user_id='me', api_root=API_ROOT,
+                 token_path='token.json', limiter=None):
+        self.credentials = credentials
+        self.limiter = limiter
+        self.retry = RetryPolicy()
+        self._refresh_retry = RetryPolicy(breaker=oauth_breaker)
+        self.timeout = timeout
+        self.user_id = user_id
+        self.token_path = token_path
+
+        url = urllib.parse.urlsplit(api_root)
+        self._host = url.hostname
+        self._secure = url.scheme == 'https'
+        default_port = 443 if self._secure else 80
+        self._port = url.port or default_port
+        # Host header value: the port is only named when it is not the default
+        host = f'[{self._host}]' if ':' in self._host else self._host
+        self._authority = host if self._port == default_port else f'{host}:{self._port}'
+        self._base_path = url.path.rstrip('/')
+
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._refresh_lock = asyncio.Lock()
+        self._idle = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _save_credentials(self):
+        """Persist refreshed credentials in the usual token.json format"""
+        with open(self.token_path, 'w') as token:
+            token.write(self.credentials.to_json())
+
+    async def _access_token(self):
+        """Return a valid access token, refreshing without blocking the loop"""
+        if not self.credentials.valid:
+            async with self._refresh_lock:
+                if not self.credentials.valid:
+                    await asyncio.to_thread(refresh_credentials, self.credentials, self._refresh_retry)
+                    await asyncio.to_thread(self._save_credentials)
+        return self.credentials.token
+
+    async def _connect(self):
+        """Reuse an idle connection or open a new one"""
+        while self._idle:
+            reader, writer = self._idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+
+        ssl_context = ssl.create_default_context() if self._secure else None
+        return await asyncio.open_connection(self._host, self._port, ssl=ssl_context)
+
+    async def _request(self, method, path, payload=None):
+        """Make one API call and return the decoded JSON response"""
+        token = await self._access_token()
+        body = json.dumps(payload).encode() if payload is not None else b''
+        request = (
+            f'{method} {self._base_path}{path} HTTP/1.1\r\n'
+            f'Host: {self._authority}\r\n'
+            f'Authorization: Bearer {token}\r\n'
+            'Content-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            '\r\n'
+        ).encode() + body
+
+        reader, writer = await self._connect()
+        reusable = False
+        try:
+            writer.write(request)
+            await writer.drain()
+            status, headers, content = await _read_response(reader)
+            reusable = headers.get('connection', '').lower() != 'close'
+        finally:
+            # Cancelled or failed requests leave the stream in an unknown state
+            if reusable:
+                self._idle.append((reader, writer))
+            else:
+                writer.close()
+
+        if status >= 300:
+            response = httplib2.Response(dict(headers, status=status))
+            raise HttpError(response, content, uri=f'{self._authority}{path}')
+        return json.loads(content)
+
+    def _user_path(self, suffix):
+        return f'/gmail/v1/users/{urllib.parse.quote(self.user_id)}/{suffix}'
+
+    async def get_profile(self):
+        """Return the authenticated user's Gmail profile"""
+        return await asyncio.wait_for(
+            self._request('GET', self._user_path('profile')), self.timeout)
+
+    async def _send(self, message):
+        with phase('send'):
+            return await self._request('POST', self._user_path('messages/send'), message)
+
+    async def _send_with_retry(self, message):
+        """Send with classified retries, pacing through the limiter if there is one
+
+        Mirrors gmail_retry.RetryPolicy.call without blocking the event loop.
+        """
+        retry = self.retry
+        for attempt in range(retry.max_retries + 1):
+            while (delay := retry.breaker.reserve()) > 0:
+                await asyncio.sleep(delay)
+            try:
+                if self.limiter is not None:
+                    await asyncio.sleep(self.limiter.reserve(QUOTA_UNITS['messages.send']))
+                result = await self._send(message)
+            except asyncio.CancelledError:
+                # Timed out by send(); a half-open probe must not stay taken
+                retry.breaker.release()
+                raise
+            except Exception as error:
+                kind = classify(error)
+                if kind == TRANSIENT:
+                    retry.breaker.record_failure()
+                else:
+                    retry.breaker.record_success()
+                if kind == PERMANENT or attempt == retry.max_retries:
+                    retry.record_failure()
+                    raise
+                retry.record_retry()
+                if kind == THROTTLED:
+                    if self.limiter is not None:
+                        self.limiter.on_throttle(retry_after_seconds(error))
+                    await asyncio.sleep(throttle_delay(error, attempt))
+                else:
+                    await asyncio.sleep(backoff_delay(attempt, cap=retry.cap))
+                continue
+
+            retry.breaker.record_success()
+            if self.limiter is not None:
+                self.limiter.on_success()
+            return result
+
+    async def send(self, message, timeout=None):
+        """Send one prepared message and return the API response
+
+        Raises asyncio.TimeoutError if the send does not finish in time. The
+        timeout covers retries, backing off and waiting for quota.
+        """
+        async with self._semaphore:
+            return await asyncio.wait_for(self._send_with_retry(message), timeout or self.timeout)
+
+    async def send_all(self, messages, timeout=None):
+        """Send prepared messages concurrently
+
+        Returns (sent, errors): sent maps message index to Gmail message ID,
+        errors maps index to exception, as in batch_gmail_sender.send_batch.
+        """
+        results = await asyncio.gather(
+            *(self.send(message, timeout) for message in messages),
+            return_exceptions=True)
+
+        sent = {}
+        errors = {}
+        for index, result in enumerate(results):
+            if isinstance(result, BaseException):
+                errors[index] = result
+            else:
+                sent[index] = result['id']
+        return sent, errors
+
+    async def close(self):
+        """Close every idle connection"""
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+async def main():
+    # Recipients for FantasyPros API support, one individual copy each
+    recipients = ['api@fantasypros.com', 'rodric@fantasypros.com']
+
+    # Read the email content
+    try:
+        content = load_template('fantasypros_api_email.txt').render()
+        subject, body = content.subject, content.body
+    except FileNotFoundError:
+        print("ERROR: fantasypros_api_email.txt not found!")
+        return
+
+    try:
+        creds = load_credentials()
+    except (FileNotFoundError, ValueError) as error:
+        print(f"ERROR: could not load token.json: {error}")
+        print("Run automated_gmail_sender.py once to authenticate.")
+        return
+
+    async with AsyncGmailSender(creds, limiter=RateLimiter()) as sender:
+        profile = await sender.get_profile()
+        sender_email = profile.get('emailAddress')
+        print(f"Authenticated as: {sender_email}")
+
+        messages = [
+            create_message(sender=sender_email, recipients=[recipient], subject=subject, body=body)
+            for recipient in recipients
+        ]
+
+        print(f"Sending {len(messages)} messages...")
+        sent, errors = await sender.send_all(messages)
+
+    for index, message_id in sorted(sent.items()):
+        print(f"Message to {recipients[index]} sent! Message ID: {message_id}")
+    for index, error in sorted(errors.items()):
+        print(f"Message to {recipients[index]} failed: {error!r}")
+
+    print(f"Done: {len(sent)} sent, {len(errors)} failed, {sender.retry.retries} retries")
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -5,79 +5,179 @@ Uses saved OAuth tokens for automated email sending
 """
 
 import os
-import base64
+import sys
+import datetime
 import json
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-import http.server
-import socketserver
 import urllib.parse
 import threading
-import time
+from gmail_metrics import phase
+from email_templates import load_template
+
+# The Google client libraries, the email package and http.server are
+# imported inside the functions that use them, so that status checks run
+# from cron only pay for a JSON read
 
 # Gmail API scope for sending emails
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
 
-class OAuthHandler(http.server.SimpleHTTPRequestHandler):
-    """Handle OAuth callback"""
-    def __init__(self, *args, **kwargs):
-        self.auth_code = None
-        super().__init__(*args, **kwargs)
+# Seconds to wait for the browser to complete authorization
+AUTH_TIMEOUT = 300
 
-    def do_GET(self):
-        if self.path.startswith('/?'):
-            # Parse the authorization code from the callback
-            parsed = urllib.parse.urlparse(self.path)
-            params = urllib.parse.parse_qs(parsed.query)
+# Matches google.auth's early-expiry margin so the fast status check agrees
+# with Credentials.valid
+REFRESH_THRESHOLD = datetime.timedelta(seconds=20)
 
-            if 'code' in params:
-                self.auth_code = params['code'][0]
-                print(f"✅ Received authorization code: {self.auth_code[:20]}...")
+class OAuthCallbackBroker:
+    """Receive one OAuth redirect on an ephemeral loopback port
 
-                # Send success response
-                self.send_response(200)
-                self.send_header('Content-type', 'text/html')
-                self.end_headers()
-                self.wfile.write(b'''
-                    <html>
-                    <body>
-                    <h1>Authorization Successful!</h1>
-                    <p>You can close this window. The email system is now authenticated.</p>
-                    <script>setTimeout(function(){window.close();}, 3000);</script>
-                    </body>
-                    </html>
-                ''')
-
-                # Store the code globally
-                global received_auth_code
-                received_auth_code = self.auth_code
-            else:
-                self.send_response(400)
-                self.send_header('Content-type', 'text/html')
-                self.end_headers()
-                self.wfile.write(b'<html><body><h1>Error: No authorization code received</h1></body></html>')
-        else:
-            super().do_GET()
+    start() binds the listening socket before returning, so the redirect URI
+    is usable immediately. The callback thread hands the code over through a
+    threading.Event, redirects whose state parameter does not match are
+    rejected, and stop() shuts the server down. Each broker has its own port
+    and state, so several accounts can authorize at once in one process.
+    """
+
+    def __init__(self, host='localhost', port=0):
+        import secrets
+
+        self.host = host
+        self.port = port
+        self.state = secrets.token_urlsafe(32)
+        self.code = None
+        self.error = None
+        self._received = threading.Event()
+        self._server = None
+        self._thread = None
+
+    @property
+    def redirect_uri(self):
+        return f'http://{self.host}:{self.port}/'
 
-def start_local_server():
-    """Start local server to receive OAuth callback"""
-    PORT = 8080
+    def __enter__(self):
+        return self.start()
 
-    with socketserver.TCPServer(("", PORT), OAuthHandler) as httpd:
-        print(f"🌐 Started local server on http://localhost:{PORT}")
-        httpd.serve_forever()
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """Bind the callback server and serve it from a daemon thread"""
+        import http.server
+
+        broker = self
+
+        class CallbackHandler(http.server.BaseHTTPRequestHandler):
+            """Handle OAuth callback"""
+
+            def do_GET(self):
+                status, page = broker._callback(self.path)
+                self.send_response(status)
+                self.send_header('Content-type', 'text/html')
+                self.send_header('Content-Length', str(len(page)))
+                self.end_headers()
+                self.wfile.write(page)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = http.server.HTTPServer((self.host, self.port), CallbackHandler)
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name=f'oauth-callback-{self.port}', daemon=True)
+        self._thread.start()
+        return self
+
+    def _callback(self, path):
+        """Validate one redirect and return (status, html)"""
+        params = urllib.parse.parse_qs(urllib.parse.urlparse(path).query)
+        if not params:
+            return 404, b'<html><body><h1>Not found</h1></body></html>'
+        if self._received.is_set():
+            return 409, b'<html><body><h1>Authorization already completed</h1></body></html>'
+        if params.get('state', [None])[0] != self.state:
+            return 400, b'<html><body><h1>Error: State mismatch, request ignored</h1></body></html>'
+
+        if 'error' in params:
+            import html
+
+            self.error = params['error'][0]
+            self._received.set()
+            return 400, f'<html><body><h1>Authorization failed: {html.escape(self.error)}</h1></body></html>'.encode()
+
+        if 'code' not in params:
+            return 400, b'<html><body><h1>Error: No authorization code received</h1></body></html>'
+
+        self.code = params['code'][0]
+        print(f"✅ Received authorization code: {self.code[:20]}...")
+        self._received.set()
+        return 200, b'''
+            <html>
+            <body>
+            <h1>Authorization Successful!</h1>
+            <p>You can close this window. The email system is now authenticated.</p>
+            <script>setTimeout(function(){window.close();}, 3000);</script>
+            </body>
+            </html>
+        '''
+
+    def wait(self, timeout=None):
+        """Block until the redirect arrives; returns the code, or None on timeout or denial"""
+        self._received.wait(timeout)
+        return self.code
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = None
+
+def token_status(path='token.json'):
+    """Classify a saved token without loading the Google auth libraries
+
+    Returns 'valid', 'expired' (refreshable) or None when there is no usable
+    token. Raises ValueError for a file Credentials.from_authorized_user_file
+    would also reject.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        info = json.load(f)
+
+    missing = {'refresh_token', 'client_id', 'client_secret'}.difference(info)
+    if missing:
+        raise ValueError(f"Authorized user info was not in the expected format, missing fields {', '.join(sorted(missing))}.")
+
+    # A token saved without an expiry is treated as already expired
+    expiry = info.get('expiry')
+    now = datetime.datetime.utcnow()
+    expired = True
+    if expiry:
+        expiry = datetime.datetime.strptime(expiry.rstrip('Z').split('.')[0], '%Y-%m-%dT%H:%M:%S')
+        expired = now >= expiry - REFRESH_THRESHOLD
+
+    if info.get('token') and not expired:
+        return 'valid'
+    if expired and info.get('refresh_token'):
+        return 'expired'
+    return None
+
+def authenticate_gmail_automated(token_path='token.json', scopes=SCOPES):
+    """Automated Gmail authentication
+
+    Scripts that need more than SCOPES pass their own and keep a separate
+    token_path, since a token only carries the scopes it was granted with.
+    """
+    from google.oauth2.credentials import Credentials
+    from google_auth_oauthlib.flow import InstalledAppFlow
+    from gmail_retry import refresh_credentials
 
-def authenticate_gmail_automated():
-    """Automated Gmail authentication"""
     creds = None
 
     # Check for existing valid token
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+    if os.path.exists(token_path):
+        with phase('load_credentials'):
+            creds = Credentials.from_authorized_user_file(token_path, scopes)
 
         if creds and creds.valid:
             print("✅ Using existing valid credentials")
@@ -85,9 +185,10 @@ def authenticate_gmail_automated():
         elif creds and creds.expired and creds.refresh_token:
             print("🔄 Refreshing expired credentials")
             try:
-                creds.refresh(Request())
+                with phase('token_refresh'):
+                    refresh_credentials(creds)
                 # Save refreshed credentials
-                with open('token.json', 'w') as token:
+                with open(token_path, 'w') as token:
                     token.write(creds.to_json())
                 print("✅ Credentials refreshed successfully")
                 return creds
@@ -103,53 +204,46 @@ def authenticate_gmail_automated():
 
         print("🔐 Starting automated OAuth flow...")
 
-        # Start local server in background
-        global received_auth_code
-        received_auth_code = None
-
-        server_thread = threading.Thread(target=start_local_server, daemon=True)
-        server_thread.start()
-
-        # Give server time to start
-        time.sleep(1)
-
-        # Create OAuth flow with localhost:8080 redirect
-        flow = InstalledAppFlow.from_client_secrets_file('oauth_credentials.json', SCOPES)
-        flow.redirect_uri = 'http://localhost:8080'
-
-        # Generate authorization URL
-        auth_url, _ = flow.authorization_url(prompt='consent', access_type='offline')
-
-        print(f"\n{'='*60}")
-        print("🔑 AUTOMATED OAUTH SETUP REQUIRED")
-        print(f"{'='*60}")
-        print(f"\n⚠️  ONE-TIME SETUP NEEDED:")
-        print(f"1. Open this URL in your browser:")
-        print(f"   {auth_url}")
-        print(f"\n2. Complete the Google authorization")
-        print(f"3. The page will redirect and show 'Authorization Successful!'")
-        print(f"4. This script will automatically continue...")
-        print(f"\n🤖 After this setup, future emails will send automatically!")
-        print(f"{'='*60}\n")
-
-        # Wait for authorization code
-        timeout = 300  # 5 minutes
-        start_time = time.time()
-
-        while received_auth_code is None and (time.time() - start_time) < timeout:
-            time.sleep(1)
-
-        if received_auth_code is None:
+        flow = InstalledAppFlow.from_client_secrets_file('oauth_credentials.json', scopes)
+
+        with OAuthCallbackBroker() as broker:
+            # Redirect to the broker's ephemeral loopback port
+            flow.redirect_uri = broker.redirect_uri
+            print(f"🌐 Waiting for the OAuth redirect on {broker.redirect_uri}")
+
+            # Generate authorization URL
+            auth_url, _ = flow.authorization_url(prompt='consent', access_type='offline',
+                                                 state=broker.state)
+
+            print(f"\n{'='*60}")
+            print("🔑 AUTOMATED OAUTH SETUP REQUIRED")
+            print(f"{'='*60}")
+            print(f"\n⚠️  ONE-TIME SETUP NEEDED:")
+            print(f"1. Open this URL in your browser:")
+            print(f"   {auth_url}")
+            print(f"\n2. Complete the Google authorization")
+            print(f"3. The page will redirect and show 'Authorization Successful!'")
+            print(f"4. This script will automatically continue...")
+            print(f"\n🤖 After this setup, future emails will send automatically!")
+            print(f"{'='*60}\n")
+
+            # Wait for the redirect to land
+            auth_code = broker.wait(AUTH_TIMEOUT)
+
+        if broker.error:
+            print(f"❌ Authorization denied: {broker.error}")
+            return None
+        if auth_code is None:
             print("❌ Timeout waiting for authorization")
             return None
 
         # Exchange code for credentials
         try:
-            flow.fetch_token(code=received_auth_code)
+            flow.fetch_token(code=auth_code)
             creds = flow.credentials
 
             # Save credentials
-            with open('token.json', 'w') as token:
+            with open(token_path, 'w') as token:
                 token.write(creds.to_json())
 
             print("✅ OAuth setup completed! Credentials saved.")
@@ -161,6 +255,15 @@ def authenticate_gmail_automated():
 
 def send_fantasypros_email():
     """Send FantasyPros API key request email"""
+    import base64
+    from email.mime.text import MIMEText
+    from email.mime.multipart import MIMEMultipart
+    from gmail_discovery import build_gmail_service
+    from dedup_index import message_key, open_dedup_index, send_once
+    from gmail_outbox import open_outbox, send_through_outbox
+    from gmail_retry import RetryPolicy
+    from sender_identity import cached_sender_email, forget_sender_email, is_identity_error
+
     print("📧 FantasyPros Email Sender - Automated Mode")
     print("="*50)
 
@@ -172,11 +275,10 @@ def send_fantasypros_email():
 
     try:
         # Build Gmail service
-        service = build('gmail', 'v1', credentials=creds)
+        service = build_gmail_service(creds)
 
-        # Get user profile
-        profile = service.users().getProfile(userId='me').execute()
-        sender_email = profile.get('emailAddress')
+        # Sender address, cached next to token.json
+        sender_email = cached_sender_email(service, creds)
         print(f"✅ Authenticated as: {sender_email}")
 
         # Recipients
@@ -187,13 +289,8 @@ def send_fantasypros_email():
             print("❌ Email content file not found: fantasypros_api_email.txt")
             return False
 
-        with open('fantasypros_api_email.txt', 'r') as f:
-            email_content = f.read()
-
-        # Parse email content
-        lines = email_content.split('\n')
-        subject = lines[0].replace('Subject: ', '')
-        body = '\n'.join(lines[2:])
+        content = load_template('fantasypros_api_email.txt').render()
+        subject, body = content.subject, content.body
 
         print(f"\n📤 Preparing email:")
         print(f"   📨 Subject: {subject}")
@@ -207,16 +304,33 @@ def send_fantasypros_email():
         message.attach(MIMEText(body, 'plain'))
 
         # Encode message
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+        with phase('encode'):
+            raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
         email_message = {'raw': raw_message}
 
         # Send email
         print(f"\n🚀 Sending email...")
-        result = service.users().messages().send(userId='me', body=email_message).execute()
+        retry = RetryPolicy()
+        with open_dedup_index() as dedup, open_outbox() as outbox:
+            if outbox is None:
+                send = lambda: retry.call(
+                    lambda: service.users().messages().send(userId='me', body=email_message).execute())
+            else:
+                # Stored before sending, so a crash here is retried by the next drain
+                send = lambda: send_through_outbox(service, outbox, email_message, retry=retry)
+            with phase('send'):
+                result = send_once(send, message_key(recipients, subject, body), dedup)
+
+        if result is None:
+            print(f"\n⏭️  This email was already sent (or may have been), not sending it again")
+            print(f"   If it never arrived: python3 dedup_index.py --release-pending")
+            return True
 
         print(f"\n🎉 SUCCESS! Email sent successfully!")
         print(f"📧 Recipients: {', '.join(recipients)}")
         print(f"📝 Message ID: {result['id']}")
+        if retry.retries:
+            print(f"🔁 Retries: {retry.retries}")
         print(f"📨 Subject: {subject}")
         print(f"\n✅ FantasyPros API key activation request has been sent!")
 
@@ -224,26 +338,32 @@ def send_fantasypros_email():
 
     except Exception as e:
         print(f"❌ Failed to send email: {e}")
+        if is_identity_error(e):
+            forget_sender_email()
         return False
 
 def check_credentials_status():
     """Check if we already have valid credentials"""
-    if os.path.exists('token.json'):
-        try:
-            creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-            if creds and creds.valid:
-                print("✅ Valid credentials found - ready for automated sending!")
-                return True
-            elif creds and creds.expired and creds.refresh_token:
-                print("🔄 Credentials exist but expired - will auto-refresh")
-                return True
-        except Exception as e:
-            print(f"⚠️  Credentials file exists but invalid: {e}")
+    try:
+        with phase('load_credentials'):
+            status = token_status('token.json')
+        if status == 'valid':
+            print("✅ Valid credentials found - ready for automated sending!")
+            return True
+        elif status == 'expired':
+            print("🔄 Credentials exist but expired - will auto-refresh")
+            return True
+    except Exception as e:
+        print(f"⚠️  Credentials file exists but invalid: {e}")
 
     print("🔐 No valid credentials - one-time OAuth setup required")
     return False
 
 if __name__ == '__main__':
+    # Fast path for health checks: report and exit without sending
+    if '--status' in sys.argv[1:]:
+        sys.exit(0 if check_credentials_status() else 1)
+
     print("🤖 Automated Gmail Sender for FantasyPros API Request")
     print("="*60)
 
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Batch Gmail Sender
+Sends many prepared messages through Gmail API HTTP batch requests
+"""
+
+import itertools
+import time
+
+from email_templates import load_template
+from gmail_metrics import phase
+from gmail_rate_limiter import (
+    QUOTA_UNITS, RateLimiter, backoff_delay, retry_after_seconds, throttle_delay)
+from gmail_retry import PERMANENT, THROTTLED, TRANSIENT, RetryPolicy, classify
+from send_gmail_oauth import authenticate_gmail, create_message
+
+# Gmail accepts up to 100 calls per batch, but Google recommends 50 or fewer
+# since larger batches are likely to trigger rate limiting
+BATCH_SIZE = 50
+
+def chunked(items, size):
+    """Yield lists of at most size items from any iterable"""
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def send_batch(service, user_id, messages, batch_size=BATCH_SIZE, limiter=None, retry=None):
+    """Send prepared messages in HTTP batches
+
+    Returns (sent, errors): sent maps each message's index to its Gmail
+    message ID, errors maps the index of each failed message to its exception.
+    Items that fail transiently (network, 5xx) or are throttled are retried
+    with backoff behind the shared circuit breaker; pass a
+    gmail_retry.RetryPolicy as retry to read back the retry count. With a
+    gmail_rate_limiter.RateLimiter, every batch is paced by its quota cost.
+    """
+    retry = retry or RetryPolicy()
+    sent = {}
+    errors = {}
+
+    def on_response(request_id, response, exception):
+        index = int(request_id)
+        if exception is not None:
+            errors[index] = exception
+        else:
+            sent[index] = response['id']
+
+    def execute(chunk):
+        batch = service.new_batch_http_request(callback=on_response)
+        for index, message in chunk:
+            request = service.users().messages().send(userId=user_id, body=message)
+            batch.add(request, request_id=str(index))
+
+        retry.breaker.acquire()
+        try:
+            with phase('send_batch'):
+                batch.execute()
+        except Exception as error:
+            # The whole batch request failed, so none of its items were sent
+            for index, _ in chunk:
+                errors.setdefault(index, error)
+        except BaseException:
+            retry.breaker.release()
+            raise
+
+        # The API is only considered down if nothing in the batch got through
+        if all(index in errors and classify(errors[index]) == TRANSIENT for index, _ in chunk):
+            retry.breaker.record_failure()
+        else:
+            retry.breaker.record_success()
+
+    for chunk in chunked(enumerate(messages), batch_size):
+        for attempt in range(retry.max_retries + 1):
+            if limiter is not None:
+                limiter.acquire(len(chunk) * QUOTA_UNITS['messages.send'])
+            execute(chunk)
+
+            failed = [(index, message) for index, message in chunk
+                      if index in errors and classify(errors[index]) != PERMANENT]
+            throttled = [index for index, _ in failed if classify(errors[index]) == THROTTLED]
+            if limiter is not None and not throttled:
+                limiter.on_success()
+            if not failed or attempt == retry.max_retries:
+                break
+
+            if throttled:
+                error = errors[throttled[0]]
+                if limiter is not None:
+                    limiter.on_throttle(retry_after_seconds(error))
+                time.sleep(throttle_delay(error, attempt))
+            else:
+                time.sleep(backoff_delay(attempt, cap=retry.cap))
+            for index, _ in failed:
+                del errors[index]
+                retry.record_retry()
+            chunk = failed
+
+    return sent, errors
+
+def main():
+    # Recipients for FantasyPros API support, one individual copy each
+    recipients = ['api@fantasypros.com', 'rodric@fantasypros.com']
+
+    # Read the email content
+    try:
+        content = load_template('fantasypros_api_email.txt').render()
+        subject, body = content.subject, content.body
+    except FileNotFoundError:
+        print("ERROR: fantasypros_api_email.txt not found!")
+        return
+
+    # Authenticate Gmail
+    result = authenticate_gmail()
+    if not result:
+        return
+
+    service, sender_email = result
+    print(f"Authenticated as: {sender_email}")
+
+    messages = [
+        create_message(sender=sender_email, recipients=[recipient], subject=subject, body=body)
+        for recipient in recipients
+    ]
+
+    print(f"Sending {len(messages)} messages in batches of {BATCH_SIZE}...")
+    retry = RetryPolicy()
+    sent, errors = send_batch(service, 'me', messages, limiter=RateLimiter(), retry=retry)
+
+    for index, message_id in sorted(sent.items()):
+        print(f"Message to {recipients[index]} sent! Message ID: {message_id}")
+    for index, error in sorted(errors.items()):
+        print(f"Message to {recipients[index]} failed: {error}")
+
+    print(f"Done: {len(sent)} sent, {len(errors)} failed, {retry.retries} retries")
+
+if __name__ == '__main__':
+    main()
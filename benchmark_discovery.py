@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Discovery Startup Benchmark
+Compares cold vs cached Gmail service build() time in fresh interpreters
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+RUNS = 10
+
+# Each snippet runs in a fresh process and prints the build time in seconds;
+# imports happen before the timer starts so only build() itself is measured
+SNIPPETS = {
+    'stock build()': (
+        "import time\n"
+        "from google.auth.credentials import AnonymousCredentials\n"
+        "from googleapiclient.discovery import build\n"
+        "start = time.perf_counter()\n"
+        "build('gmail', 'v1', credentials=AnonymousCredentials())\n"
+        "print(time.perf_counter() - start)\n"
+    ),
+    'cold cache': (
+        "import time\n"
+        "from google.auth.credentials import AnonymousCredentials\n"
+        "import gmail_discovery\n"
+        "gmail_discovery.clear_discovery_cache()\n"
+        "start = time.perf_counter()\n"
+        "gmail_discovery.build_gmail_service(AnonymousCredentials())\n"
+        "print(time.perf_counter() - start)\n"
+    ),
+    'cached': (
+        "import time\n"
+        "from google.auth.credentials import AnonymousCredentials\n"
+        "import gmail_discovery\n"
+        "start = time.perf_counter()\n"
+        "gmail_discovery.build_gmail_service(AnonymousCredentials())\n"
+        "print(time.perf_counter() - start)\n"
+    ),
+}
+
+def time_snippet(snippet, env):
+    """Run snippet in a fresh interpreter and return the reported time"""
+    output = subprocess.run(
+        [sys.executable, '-c', snippet], env=env, check=True,
+        capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    return float(output.stdout.strip().splitlines()[-1])
+
+def main():
+    with tempfile.TemporaryDirectory() as cache_home:
+        # Keep the benchmark away from the user's real discovery cache
+        env = dict(os.environ, XDG_CACHE_HOME=cache_home)
+
+        print(f"Gmail build() startup benchmark ({RUNS} fresh processes each)")
+        print("=" * 60)
+        for name, snippet in SNIPPETS.items():
+            timings = [time_snippet(snippet, env) * 1000 for _ in range(RUNS)]
+            print(f"{name:<15} median {statistics.median(timings):7.2f} ms   "
+                  f"min {min(timings):7.2f} ms   max {max(timings):7.2f} ms")
+
+if __name__ == '__main__':
+    main()
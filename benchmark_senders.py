@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Sender Benchmark Suite
+Drives the sender scripts against the local fake Gmail API server and reports
+throughput, latency percentiles and memory
+"""
+
+import contextlib
+import datetime
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+
+from google.oauth2.credentials import Credentials
+
+import automated_gmail_sender
+import gmail_discovery
+import simple_email_sender
+from batch_gmail_sender import send_batch
+from concurrent_gmail_sender import ConcurrentSender
+from dedup_index import DEDUP_PATH_ENV
+from fake_gmail_server import FakeGmailServer, FakeSmtpServer
+from gmail_discovery import DISCOVERY_URL_ENV, build_gmail_service
+from gmail_transports import SMTP_SCOPE, MaildirTransport, SmtpTransport
+from send_gmail_oauth import create_message, send_email
+
+# Simulated API round trip in seconds
+LATENCY = 0.02
+
+# Calls per scenario, and calls repeated under tracemalloc for peak memory
+ITERATIONS = 200
+MEMORY_ITERATIONS = 20
+
+BATCH_SIZE = 50
+CONCURRENCY = 8
+
+EMAIL_CONTENT = (
+    "Subject: FantasyPros API Key Activation Request\n\n"
+    "Hello FantasyPros Team,\n\n" + "Please activate my API key.\n" * 20
+)
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    index = max(0, min(len(samples) - 1, int(round(fraction * len(samples))) - 1))
+    return samples[index]
+
+def write_fixtures(server):
+    """Create token.json and the email content file in the current directory"""
+    creds = Credentials(
+        token='fake-access-token', refresh_token='fake-refresh-token',
+        token_uri=server.token_url, client_id='benchmark', client_secret='benchmark',
+        scopes=automated_gmail_sender.SCOPES + [SMTP_SCOPE],
+        expiry=datetime.datetime.utcnow() + datetime.timedelta(hours=1))
+    with open('token.json', 'w') as token:
+        token.write(creds.to_json())
+    with open('fantasypros_api_email.txt', 'w') as f:
+        f.write(EMAIL_CONTENT)
+    return creds
+
+def measure(name, call, messages_per_call=1):
+    """Time ITERATIONS calls, then rerun a few under tracemalloc for peak memory"""
+    latencies = []
+    quiet = io.StringIO()
+    with contextlib.redirect_stdout(quiet):
+        start = time.perf_counter()
+        for _ in range(ITERATIONS):
+            call_start = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - call_start)
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        for _ in range(MEMORY_ITERATIONS):
+            call()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    latencies.sort()
+    rate = ITERATIONS * messages_per_call / elapsed
+    print(f"{name:<46} {rate:9.1f} msg/s   "
+          f"p50 {percentile(latencies, 0.50) * 1000:7.1f} ms   "
+          f"p95 {percentile(latencies, 0.95) * 1000:7.1f} ms   "
+          f"p99 {percentile(latencies, 0.99) * 1000:7.1f} ms   "
+          f"peak {peak / 1024:8.0f} KB")
+
+def main():
+    server = FakeGmailServer(latency=LATENCY).start()
+    smtp_server = FakeSmtpServer(latency=LATENCY).start()
+    old_cwd = os.getcwd()
+    old_cache_dir = gmail_discovery.CACHE_DIR
+    old_env = {name: os.environ.get(name) for name in (DISCOVERY_URL_ENV, DEDUP_PATH_ENV)}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        os.environ[DISCOVERY_URL_ENV] = server.discovery_url
+        # Keep the fake server's discovery document out of the real cache
+        gmail_discovery.CACHE_DIR = os.path.join(workdir, 'discovery')
+        # Every iteration sends the same email; measure sending, not skipping
+        os.environ[DEDUP_PATH_ENV] = ''
+        try:
+            creds = write_fixtures(server)
+            service = build_gmail_service(creds)
+            message = create_message('benchmark@example.com', ['api@fantasypros.com'],
+                                     'Benchmark', EMAIL_CONTENT)
+
+            print(f"Sender benchmark against fake Gmail API ({LATENCY * 1000:.0f} ms latency, "
+                  f"{ITERATIONS} calls each)")
+            print("=" * 132)
+
+            measure('send_email', lambda: send_email(service, 'me', message))
+            measure('send_fantasypros_email', automated_gmail_sender.send_fantasypros_email)
+            measure('send_email_with_existing_token',
+                    simple_email_sender.send_email_with_existing_token)
+            measure(f'send_batch ({BATCH_SIZE} per call)',
+                    lambda: send_batch(service, 'me', [message] * BATCH_SIZE),
+                    messages_per_call=BATCH_SIZE)
+            with ConcurrentSender(creds, concurrency=CONCURRENCY) as sender:
+                measure(f'ConcurrentSender ({CONCURRENCY} workers, {CONCURRENCY * 4} per call)',
+                        lambda: sender.send_all([message] * CONCURRENCY * 4),
+                        messages_per_call=CONCURRENCY * 4)
+            with SmtpTransport(creds, 'benchmark@example.com', host=smtp_server.host,
+                               port=smtp_server.port, starttls=False) as transport:
+                measure('send_email via SmtpTransport',
+                        lambda: send_email(service, 'me', message, transport=transport))
+            with MaildirTransport('maildir') as transport:
+                measure('send_email via MaildirTransport',
+                        lambda: send_email(service, 'me', message, transport=transport))
+
+            print("=" * 132)
+            print(f"Server counts: {server.counts}")
+            print(f"SMTP server counts: {smtp_server.counts}")
+        finally:
+            os.chdir(old_cwd)
+            gmail_discovery.CACHE_DIR = old_cache_dir
+            for name, value in old_env.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+            server.stop()
+            smtp_server.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Template Render Benchmark
+Measures per-recipient render throughput of compiled email templates
+"""
+
+import os
+import tempfile
+import time
+
+from email_templates import EmailTemplate, load_template
+
+RENDERS = 100000
+
+TEMPLATES = {
+    'static content': (
+        "Subject: FantasyPros API Key Activation Request\n\n"
+        "Hello FantasyPros Team,\n\n" + "Please activate my API key.\n" * 20
+    ),
+    'personalized': (
+        "Subject: Hello {{ name }}, your {{ plan }} plan\n"
+        "Reply-To: {{ account_manager }}\n\n"
+        "Hi {{ name }},\n\n" + "Your {{ plan }} plan renews on {{ renewal }}.\n" * 20
+    ),
+}
+
+CONTEXT = {
+    'name': 'Alex',
+    'plan': 'Premium',
+    'account_manager': 'support@example.com',
+    'renewal': '2026-11-01',
+}
+
+def naive_render(path, context):
+    """Re-read, re-parse and substitute on every send, as the scripts used to"""
+    with open(path, 'r') as f:
+        email_content = f.read()
+    lines = email_content.split('\n')
+    subject = lines[0].replace('Subject: ', '')
+    body = '\n'.join(lines[2:])
+    for name, value in context.items():
+        subject = subject.replace(f'{{{{ {name} }}}}', value)
+        body = body.replace(f'{{{{ {name} }}}}', value)
+    return subject, body
+
+def rate(func, count):
+    """Call func count times and return calls per second"""
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return count / (time.perf_counter() - start)
+
+def main():
+    print(f"Template render throughput ({RENDERS} renders each)")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, text in TEMPLATES.items():
+            path = os.path.join(tmp, f'{name.replace(" ", "_")}.txt')
+            with open(path, 'w') as f:
+                f.write(text)
+
+            template = EmailTemplate.parse(text)
+            compiled = rate(lambda: template.render(CONTEXT), RENDERS)
+            cached = rate(lambda: load_template(path).render(CONTEXT), RENDERS)
+            naive = rate(lambda: naive_render(path, CONTEXT), RENDERS // 10)
+
+            print(f"{name}:")
+            print(f"   compiled render        {compiled:12,.0f} renders/sec")
+            print(f"   load_template + render {cached:12,.0f} renders/sec")
+            print(f"   re-read + re-parse     {naive:12,.0f} renders/sec")
+
+if __name__ == '__main__':
+    main()
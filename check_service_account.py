@@ -5,7 +5,7 @@ Check service account capabilities and attempt to send email
 
 import os
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from gmail_discovery import build_gmail_service
 
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
 
@@ -19,7 +19,7 @@ def check_service_account():
         print(f"Project ID: {credentials.project_id}")
         
         # Try to build Gmail service
-        service = build('gmail', 'v1', credentials=credentials)
+        service = build_gmail_service(credentials)
         
         # Test basic access
         profile = service.users().getProfile(userId='me').execute()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Startup Time Check
+Fails when the health-check entry points import heavy dependencies or blow
+their import-time budget, measured with python -X importtime
+"""
+
+import os
+import subprocess
+import sys
+
+# Cumulative import time allowed per module, in milliseconds
+BUDGETS_MS = {
+    'run_automated_sender': 20,
+    'automated_gmail_sender': 40,
+}
+
+# Modules that must only load on first use, never at import
+HEAVY_MODULES = (
+    'googleapiclient',
+    'google_auth_oauthlib',
+    'google.oauth2',
+    'google.auth.transport',
+    'http.server',
+    'email.mime',
+)
+
+# Best of this many runs, to ride out a noisy machine
+RUNS = 5
+
+def import_profile(module):
+    """Import module in a fresh interpreter and return {name: cumulative_us}"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True)
+
+    profile = {}
+    for line in result.stderr.splitlines():
+        # import time: <self us> | <cumulative us> | <indented module name>
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        profile[name.strip()] = int(cumulative)
+    return profile
+
+def check_module(module, budget_ms):
+    """Return a list of problems found for module"""
+    problems = []
+    profiles = [import_profile(module) for _ in range(RUNS)]
+
+    loaded_heavy = sorted(
+        name for name in profiles[0]
+        if any(name == heavy or name.startswith(heavy + '.') for heavy in HEAVY_MODULES))
+    if loaded_heavy:
+        problems.append(f"{module} imports {', '.join(loaded_heavy)} at startup")
+
+    best_ms = min(profile[module] for profile in profiles) / 1000
+    status = 'ok' if best_ms <= budget_ms else 'OVER BUDGET'
+    print(f"{module:<28} {best_ms:7.1f} ms  (budget {budget_ms} ms)  {status}")
+    if best_ms > budget_ms:
+        problems.append(f"{module} took {best_ms:.1f} ms to import, budget is {budget_ms} ms")
+    return problems
+
+def main():
+    problems = []
+    for module, budget_ms in BUDGETS_MS.items():
+        problems.extend(check_module(module, budget_ms))
+
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    return 1 if problems else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
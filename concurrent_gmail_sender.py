@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Concurrent Gmail Sender
+Sends messages from a pool of worker threads, each with its own HTTP transport
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+
+from automated_gmail_sender import authenticate_gmail_automated
+from email_templates import load_template
+from gmail_discovery import build_gmail_service
+from gmail_metrics import phase
+from gmail_rate_limiter import QUOTA_UNITS, RateLimiter, execute_with_rate_limit
+from gmail_retry import RetryPolicy, oauth_breaker, refresh_credentials
+from send_gmail_oauth import create_message
+from sender_identity import cached_sender_email
+
+# Number of sends kept in flight at once
+DEFAULT_CONCURRENCY = 8
+
+class ConcurrentSender:
+    """Fan out messages().send calls over a thread pool
+
+    httplib2 transports are not thread-safe, so every worker thread lazily
+    builds its own authorized transport and Gmail service from the shared
+    credentials. Token refresh is serialized so only one thread refreshes.
+    Pass a gmail_rate_limiter.RateLimiter to keep all workers under quota.
+    Transient failures are retried through one shared RetryPolicy, whose
+    retries count is available as sender.retry.retries. With a limiter,
+    throttling is retried by the limiter alone.
+    """
+
+    def __init__(self, credentials, concurrency=DEFAULT_CONCURRENCY, user_id='me', limiter=None):
+        self.credentials = credentials
+        self.concurrency = concurrency
+        self.user_id = user_id
+        self.limiter = limiter
+        self.retry = RetryPolicy(retry_throttled=limiter is None)
+        self._refresh_retry = RetryPolicy(breaker=oauth_breaker)
+        self._local = threading.local()
+        self._refresh_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix='gmail-sender')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _service(self):
+        """Return the calling thread's Gmail service, building it on first use"""
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            http = AuthorizedHttp(self.credentials, http=httplib2.Http())
+            service = build_gmail_service(http=http)
+            self._local.service = service
+        return service
+
+    def _ensure_fresh_credentials(self):
+        """Refresh the shared credentials once if they have expired"""
+        if self.credentials.valid:
+            return
+        with self._refresh_lock:
+            if not self.credentials.valid:
+                refresh_credentials(self.credentials, self._refresh_retry)
+
+    def _execute(self, request, units):
+        self._ensure_fresh_credentials()
+        service = self._service()
+        execute = lambda: request(service).execute()
+        if self.limiter is not None:
+            return self.retry.call(lambda: execute_with_rate_limit(execute, self.limiter, units))
+        return self.retry.call(execute)
+
+    def _send(self, message):
+        with phase('send'):
+            return self._execute(
+                lambda service: service.users().messages().send(userId=self.user_id, body=message),
+                QUOTA_UNITS['messages.send'])
+
+    def submit(self, message):
+        """Queue one prepared message and return a Future for the API response"""
+        return self._executor.submit(self._send, message)
+
+    def submit_request(self, request, units):
+        """Queue any Gmail API call and return a Future for its response
+
+        request(service) builds the call on the worker's own service; it runs
+        with the same retries, and is charged units against the limiter.
+        """
+        return self._executor.submit(self._execute, request, units)
+
+    def send_all(self, messages):
+        """Send prepared messages concurrently
+
+        Returns (sent, errors) in the same shape as batch_gmail_sender.send_batch:
+        sent maps message index to Gmail message ID, errors maps index to exception.
+        """
+        futures = {index: self.submit(message) for index, message in enumerate(messages)}
+
+        sent = {}
+        errors = {}
+        for index, future in futures.items():
+            try:
+                sent[index] = future.result()['id']
+            except Exception as error:
+                errors[index] = error
+        return sent, errors
+
+    def close(self):
+        """Wait for in-flight sends and stop the worker threads"""
+        self._executor.shutdown(wait=True)
+
+def main():
+    # Recipients for FantasyPros API support, one individual copy each
+    recipients = ['api@fantasypros.com', 'rodric@fantasypros.com']
+
+    # Read the email content
+    try:
+        content = load_template('fantasypros_api_email.txt').render()
+        subject, body = content.subject, content.body
+    except FileNotFoundError:
+        print("ERROR: fantasypros_api_email.txt not found!")
+        return
+
+    creds = authenticate_gmail_automated()
+    if not creds:
+        print("Authentication failed")
+        return
+
+    sender_email = cached_sender_email(build_gmail_service(creds), creds)
+    print(f"Authenticated as: {sender_email}")
+
+    with ConcurrentSender(creds, limiter=RateLimiter()) as sender:
+        messages = [
+            create_message(sender=sender_email, recipients=[recipient], subject=subject, body=body)
+            for recipient in recipients
+        ]
+
+        print(f"Sending {len(messages)} messages with {sender.concurrency} workers...")
+        sent, errors = sender.send_all(messages)
+
+    for index, message_id in sorted(sent.items()):
+        print(f"Message to {recipients[index]} sent! Message ID: {message_id}")
+    for index, error in sorted(errors.items()):
+        print(f"Message to {recipients[index]} failed: {error}")
+
+    print(f"Done: {len(sent)} sent, {len(errors)} failed, {sender.retry.retries} retries")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""
+Send Deduplication Index
+SQLite idempotency index with a Bloom filter front, so reruns and campaign
+replays never send the same email twice
+"""
+
+import contextlib
+import hashlib
+import math
+import os
+import smtplib
+import sqlite3
+import sys
+import threading
+import time
+
+DEDUP_PATH = 'sent_index.db'
+
+# Overrides DEDUP_PATH; set it empty to turn deduplication off
+DEDUP_PATH_ENV = 'GMAIL_DEDUP_PATH'
+
+# Expected number of entries and the Bloom filter false-positive rate at
+# that size; a false positive only costs one SQLite lookup
+BLOOM_CAPACITY = 1_000_000
+BLOOM_ERROR_RATE = 0.001
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sent (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    digest BLOB NOT NULL UNIQUE,
+    status TEXT NOT NULL,
+    message_id TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE TABLE IF NOT EXISTS bloom (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    seq INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    hashes INTEGER NOT NULL,
+    bits BLOB NOT NULL
+);
+"""
+
+def message_key(recipients, subject, body, key=None):
+    """Return the 32-byte digest identifying one email
+
+    Recipients are compared case-insensitively and in any order. A caller
+    supplied key (an order ID, say) replaces the content hash.
+    """
+    if key is not None:
+        return hashlib.sha256(f'key\0{key}'.encode()).digest()
+    addresses = ','.join(sorted(address.strip().lower() for address in recipients))
+    return hashlib.sha256(f'msg\0{addresses}\0{subject}\0{body}'.encode()).digest()
+
+def send_definitely_failed(error):
+    """Return True if Gmail answered and refused, so the message did not go out
+
+    Timeouts, dropped connections and 5xx answers leave it unknown whether
+    the message was sent. An SMTP error reply always means it was not.
+    """
+    if isinstance(error, (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused)):
+        return True
+    resp = getattr(error, 'resp', None)
+    return resp is not None and 400 <= resp.status < 500
+
+class BloomFilter:
+    """Bit array answering 'definitely absent' or 'maybe present' for digests
+
+    Bit positions come from the digest itself by double hashing, so no
+    further hashing is done per lookup.
+    """
+
+    def __init__(self, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE):
+        self.size = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, digest):
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, digest):
+        for position in self._positions(digest):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, digest):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(digest))
+
+class DedupIndex:
+    """Idempotency index of emails that were sent or may have been sent
+
+    Call claim() before messages().send: it returns False if the email was
+    already claimed, so the send must be skipped. Then mark_sent() with the
+    Gmail ID, or release() when Gmail definitely rejected the message. A
+    claim left pending (timeout, crash) keeps blocking resends, because the
+    message may have gone out; clear it with release_pending() after checking
+    the Sent folder.
+
+    The Bloom filter is saved on close() and caught up from the rows added
+    since, so opening a large index does not rescan it.
+    """
+
+    def __init__(self, path=DEDUP_PATH, capacity=BLOOM_CAPACITY, error_rate=BLOOM_ERROR_RATE):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        self.bloom = self._load_bloom(capacity, error_rate)
+
+    def _load_bloom(self, capacity, error_rate):
+        """Restore the saved filter and add rows inserted after it was saved"""
+        bloom = BloomFilter(capacity, error_rate)
+        saved = self.conn.execute('SELECT seq, size, hashes, bits FROM bloom WHERE id = 1').fetchone()
+        since = 0
+        if saved and (saved[1], saved[2]) == (bloom.size, bloom.hashes):
+            since = saved[0]
+            bloom.bits = bytearray(saved[3])
+        for (digest,) in self.conn.execute('SELECT digest FROM sent WHERE seq > ?', (since,)):
+            bloom.add(digest)
+        return bloom
+
+    def save_bloom(self):
+        """Persist the Bloom filter with the last sequence number it covers"""
+        with self._lock:
+            seq = self.conn.execute('SELECT COALESCE(MAX(seq), 0) FROM sent').fetchone()[0]
+            self.conn.execute(
+                'INSERT OR REPLACE INTO bloom (id, seq, size, hashes, bits) VALUES (1, ?, ?, ?, ?)',
+                (seq, self.bloom.size, self.bloom.hashes, bytes(self.bloom.bits)))
+
+    def close(self):
+        self.save_bloom()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def status(self, digest):
+        """Return 'sent', 'pending' or None for a message_key digest"""
+        if digest not in self.bloom:
+            return None
+        with self._lock:
+            row = self.conn.execute('SELECT status FROM sent WHERE digest = ?', (digest,)).fetchone()
+        return row[0] if row else None
+
+    def claim(self, digest):
+        """Record that digest is about to be sent; False if it already was"""
+        if digest in self.bloom and self.status(digest) is not None:
+            return False
+        with self._lock:
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO sent (digest, status, created_at) VALUES (?, 'pending', ?)",
+                (digest, time.time()))
+            self.bloom.add(digest)
+        return cursor.rowcount == 1
+
+    def mark_sent(self, digest, message_id):
+        with self._lock:
+            self.conn.execute(
+                "UPDATE sent SET status = 'sent', message_id = ?, sent_at = ? WHERE digest = ?",
+                (message_id, time.time(), digest))
+
+    def release(self, digest):
+        """Forget a claim whose send definitely failed, so it can be retried"""
+        with self._lock:
+            self.conn.execute("DELETE FROM sent WHERE digest = ? AND status = 'pending'", (digest,))
+
+    def release_pending(self):
+        """Forget every pending claim and return how many there were"""
+        with self._lock:
+            return self.conn.execute("DELETE FROM sent WHERE status = 'pending'").rowcount
+
+    def counts(self):
+        with self._lock:
+            return dict(self.conn.execute('SELECT status, COUNT(*) FROM sent GROUP BY status').fetchall())
+
+def dedup_path():
+    """Return the path of the index the send scripts share, '' when disabled"""
+    return os.environ.get(DEDUP_PATH_ENV, DEDUP_PATH)
+
+def open_dedup_index():
+    """Open the index the send scripts share, or a null context when disabled"""
+    path = dedup_path()
+    return DedupIndex(path) if path else contextlib.nullcontext()
+
+def send_once(send, digest, index):
+    """Call send() unless digest is already claimed in index
+
+    Returns the API response, or None when the send was skipped as a
+    duplicate. With index None, send() is always called.
+    """
+    if index is None:
+        return send()
+    if not index.claim(digest):
+        return None
+    try:
+        result = send()
+    except Exception as error:
+        if send_definitely_failed(error):
+            index.release(digest)
+        raise
+    index.mark_sent(digest, result.get('id'))
+    return result
+
+def main():
+    path = dedup_path()
+    if not path:
+        print(f"Deduplication is disabled ({DEDUP_PATH_ENV} is empty)")
+        return
+    with DedupIndex(path) as index:
+        if sys.argv[1:] == ['--release-pending']:
+            print(f"Released {index.release_pending()} pending claim(s)")
+        print(f"{path}: {index.counts()}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Email Templates
+Parses email content files once into compiled templates and renders
+per-recipient variants with {{ placeholder }} substitution
+"""
+
+import collections
+import os
+import re
+
+PLACEHOLDER = re.compile(r'\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}')
+
+RenderedEmail = collections.namedtuple('RenderedEmail', ['subject', 'body', 'headers'])
+
+# Compiled templates keyed by absolute path, with the mtime and size they were read at
+_cache = {}
+
+def _compile(text):
+    """Split text into alternating literals and placeholder names"""
+    return tuple(PLACEHOLDER.split(text))
+
+def _render(pieces, context):
+    """Fill a compiled piece list from context"""
+    if len(pieces) == 1:
+        return pieces[0]
+    parts = list(pieces)
+    for i in range(1, len(parts), 2):
+        name = parts[i]
+        try:
+            parts[i] = str(context[name])
+        except KeyError:
+            raise KeyError(f'Template placeholder {{{{ {name} }}}} has no value') from None
+    return ''.join(parts)
+
+class EmailTemplate:
+    """A subject, body and extra headers compiled for fast rendering"""
+
+    def __init__(self, subject, body, headers=None):
+        self.subject = subject
+        self.body = body
+        self.headers = dict(headers or {})
+        self._subject = _compile(subject)
+        self._body = _compile(body)
+        self._headers = {name: _compile(value) for name, value in self.headers.items()}
+
+        pieces = [self._subject, self._body, *self._headers.values()]
+        self.fields = frozenset(name for p in pieces for name in p[1::2])
+
+    @classmethod
+    def parse(cls, text):
+        """Parse content in the 'Subject: ...', blank line, body format
+
+        Any further 'Name: value' lines before the blank line become extra
+        headers on the rendered email.
+        """
+        text = text.replace('\r\n', '\n')
+        head, _, body = text.partition('\n\n')
+
+        subject = ''
+        headers = {}
+        for line in head.split('\n'):
+            name, sep, value = line.partition(':')
+            if not sep:
+                continue
+            if name.strip().lower() == 'subject':
+                subject = value.strip()
+            else:
+                headers[name.strip()] = value.strip()
+        return cls(subject, body, headers)
+
+    def render(self, context=None, **fields):
+        """Return a RenderedEmail with placeholders filled from context and fields"""
+        if fields:
+            context = dict(context or {}, **fields)
+        elif context is None:
+            context = {}
+        return RenderedEmail(
+            _render(self._subject, context),
+            _render(self._body, context),
+            {name: _render(pieces, context) for name, pieces in self._headers.items()})
+
+def load_template(path):
+    """Return the compiled template for path, re-reading only when the file changes
+
+    Raises FileNotFoundError if path does not exist.
+    """
+    key = os.path.abspath(path)
+    stat = os.stat(key)
+    version = (stat.st_mtime_ns, stat.st_size)
+
+    cached = _cache.get(key)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with open(key, 'r') as f:
+        template = EmailTemplate.parse(f.read())
+    _cache[key] = (version, template)
+    return template
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Fake Gmail API Server
+Local stand-ins for the parts of the Gmail API and smtp.gmail.com these
+scripts use, with configurable latency, error and throttling injection for
+benchmarks
+"""
+
+import base64
+import email.parser
+import http.server
+import itertools
+import json
+import random
+import re
+import socketserver
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+
+from googleapiclient.discovery_cache import get_static_doc
+
+DISCOVERY_PATH = '/discovery/v1/apis/gmail/v1/rest'
+
+FAKE_EMAIL = 'benchmark@example.com'
+
+USER_PATH = re.compile(r'^/(upload/)?gmail/v1/users/([^/]+)/(.+)$')
+
+def _json(status, payload, headers=None):
+    return status, dict(headers or {}, **{'Content-Type': 'application/json'}), json.dumps(payload).encode()
+
+def _error(status, reason, message):
+    return _json(status, {'error': {
+        'code': status, 'message': message,
+        'errors': [{'reason': reason, 'message': message}]}})
+
+class FakeGmailServer(http.server.ThreadingHTTPServer):
+    """Threaded HTTP server answering Gmail API calls from memory
+
+    latency is added to every request (plus up to jitter seconds of random
+    extra delay); error_rate and throttle_rate are the fractions of API calls
+    answered with a 503 or a 429 with Retry-After instead of succeeding.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 throttle_rate=0.0, retry_after=1):
+        super().__init__(('127.0.0.1', port), FakeGmailHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.base_url = f'http://127.0.0.1:{self.server_address[1]}'
+        self.discovery_url = self.base_url + DISCOVERY_PATH
+        self.token_url = self.base_url + '/token'
+
+        self.sent = []
+        self.drafts = {}
+        self.counts = {'send': 0, 'profile': 0, 'batch': 0, 'token': 0, 'drafts': 0,
+                       'discovery': 0, 'errors': 0, 'throttled': 0}
+        self._ids = itertools.count(1)
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+        document = json.loads(get_static_doc('gmail', 'v1'))
+        document['rootUrl'] = document['mtlsRootUrl'] = self.base_url + '/'
+        self._discovery = json.dumps(document).encode()
+
+    def start(self):
+        """Serve from a daemon thread and return self"""
+        threading.Thread(target=self.serve_forever, name='fake-gmail', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _delay(self):
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            time.sleep(delay)
+
+    def _inject_failure(self):
+        """Return an error response for this API call, or None to let it succeed"""
+        roll = random.random()
+        if roll < self.throttle_rate:
+            self._count('throttled')
+            status, headers, body = _error(429, 'userRateLimitExceeded', 'User-rate limit exceeded')
+            headers['Retry-After'] = str(self.retry_after)
+            return status, headers, body
+        if roll < self.throttle_rate + self.error_rate:
+            self._count('errors')
+            return _error(503, 'backendError', 'Backend Error')
+        return None
+
+    def _record_send(self, raw):
+        with self._lock:
+            message_id = f'{next(self._ids):016x}'
+            self.sent.append(raw)
+            self.counts['send'] += 1
+        return _json(200, {'id': message_id, 'threadId': message_id, 'labelIds': ['SENT']})
+
+    def route(self, method, target, headers, body):
+        """Answer one request and return (status, headers, body)"""
+        url = urllib.parse.urlsplit(target)
+        path = url.path
+
+        if path == DISCOVERY_PATH:
+            self._count('discovery')
+            return 200, {'Content-Type': 'application/json'}, self._discovery
+
+        if path == '/token' and method == 'POST':
+            self._count('token')
+            return _json(200, {'access_token': f'fake-{uuid.uuid4().hex}',
+                               'expires_in': 3600, 'token_type': 'Bearer'})
+
+        if path == '/batch' and method == 'POST':
+            self._count('batch')
+            return self._batch(headers, body)
+
+        if path.startswith('/upload/session/'):
+            return self._upload_chunk(path, headers, body)
+
+        match = USER_PATH.match(path)
+        if not match:
+            return _error(404, 'notFound', f'Unknown path {path}')
+        upload, _, resource = match.groups()
+
+        if 'authorization' not in {name.lower() for name in headers}:
+            return _error(401, 'authError', 'Missing credentials')
+
+        failure = self._inject_failure()
+        if failure:
+            return failure
+
+        if resource == 'profile' and method == 'GET':
+            self._count('profile')
+            return _json(200, {'emailAddress': FAKE_EMAIL, 'messagesTotal': 0,
+                               'threadsTotal': 0, 'historyId': '1'})
+
+        if resource == 'messages/send' and method == 'POST':
+            if upload:
+                session = uuid.uuid4().hex
+                with self._lock:
+                    self._uploads[session] = bytearray()
+                return 200, {'Location': f'{self.base_url}/upload/session/{session}'}, b''
+            return self._record_send(json.loads(body or b'{}').get('raw', ''))
+
+        if resource.startswith('drafts'):
+            return self._draft(method, resource, body, urllib.parse.parse_qs(url.query))
+
+        return _error(404, 'notFound', f'Unknown method {method} {resource}')
+
+    def _draft(self, method, resource, body, query):
+        """Create, list, get, send and delete drafts"""
+        self._count('drafts')
+        if resource == 'drafts' and method == 'POST':
+            raw = json.loads(body or b'{}').get('message', {}).get('raw', '')
+            with self._lock:
+                draft_id = f'r{next(self._ids):015x}'
+                self.drafts[draft_id] = (raw, int(time.time() * 1000))
+            return _json(200, {'id': draft_id, 'message': {'id': draft_id, 'labelIds': ['DRAFT']}})
+        if resource == 'drafts' and method == 'GET':
+            start = int(query.get('pageToken', ['0'])[0])
+            size = int(query.get('maxResults', ['100'])[0])
+            with self._lock:
+                ids = list(self.drafts)
+            page = {'drafts': [{'id': draft_id} for draft_id in ids[start:start + size]],
+                    'resultSizeEstimate': len(ids)}
+            if start + size < len(ids):
+                page['nextPageToken'] = str(start + size)
+            return _json(200, page)
+        if resource == 'drafts/send' and method == 'POST':
+            with self._lock:
+                draft = self.drafts.pop(json.loads(body or b'{}').get('id'), None)
+            if draft is None:
+                return _error(404, 'notFound', 'Requested entity was not found.')
+            return self._record_send(draft[0])
+        if method == 'GET':
+            draft_id = resource.split('/', 1)[1]
+            with self._lock:
+                draft = self.drafts.get(draft_id)
+            if draft is None:
+                return _error(404, 'notFound', 'Requested entity was not found.')
+            raw, created_ms = draft
+            parsed = email.parser.BytesParser().parsebytes(base64.urlsafe_b64decode(raw), headersonly=True)
+            headers = [{'name': name, 'value': value} for name, value in parsed.items()]
+            return _json(200, {'id': draft_id, 'message': {
+                'id': draft_id, 'labelIds': ['DRAFT'], 'internalDate': str(created_ms),
+                'payload': {'headers': headers}}})
+        if method == 'DELETE':
+            with self._lock:
+                found = self.drafts.pop(resource.split('/', 1)[1], None) is not None
+            return (204, {}, b'') if found else _error(404, 'notFound', 'Requested entity was not found.')
+        return _error(404, 'notFound', f'Unknown method {method} {resource}')
+
+    def _upload_chunk(self, path, headers, body):
+        """Accept one chunk of a resumable upload"""
+        session = path.rsplit('/', 1)[1]
+        with self._lock:
+            buffer = self._uploads.get(session)
+            if buffer is None:
+                return _error(404, 'notFound', 'Unknown upload session')
+            buffer.extend(body)
+            received = len(buffer)
+
+        content_range = {name.lower(): value for name, value in headers.items()}.get('content-range', '')
+        total = content_range.rsplit('/', 1)[-1]
+        if total != '*' and received >= int(total):
+            with self._lock:
+                data = bytes(self._uploads.pop(session))
+            return self._record_send(data.decode('utf-8', 'replace'))
+        return 308, {'Range': f'bytes=0-{received - 1}'}, b''
+
+    def _batch(self, headers, body):
+        """Split a multipart/mixed batch and answer each part"""
+        content_type = {name.lower(): value for name, value in headers.items()}['content-type']
+        container = email.parser.BytesParser().parsebytes(
+            b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body)
+
+        boundary = f'batch_{uuid.uuid4().hex}'
+        out = []
+        for part in container.get_payload():
+            content_id = part['Content-ID'].strip('<>')
+            request = part.get_payload()
+            head, _, inner_body = request.partition('\r\n\r\n') if '\r\n\r\n' in request \
+                else request.partition('\n\n')
+            lines = head.splitlines()
+            method, target, _ = lines[0].split(' ', 2)
+            inner_headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+            inner_headers.setdefault('Authorization', 'batch')
+
+            status, response_headers, response_body = self.route(
+                method, target, inner_headers, inner_body.encode())
+            header_lines = ''.join(f'{name}: {value}\r\n' for name, value in response_headers.items())
+            out.append(
+                f'--{boundary}\r\n'
+                'Content-Type: application/http\r\n'
+                f'Content-ID: <response-{content_id}>\r\n\r\n'
+                f'HTTP/1.1 {status} {http.HTTPStatus(status).phrase}\r\n'
+                f'{header_lines}\r\n'
+                f'{response_body.decode()}\r\n')
+        out.append(f'--{boundary}--\r\n')
+        return 200, {'Content-Type': f'multipart/mixed; boundary={boundary}'}, ''.join(out).encode()
+
+class FakeGmailHandler(http.server.BaseHTTPRequestHandler):
+    """Hands every request to FakeGmailServer.route"""
+
+    protocol_version = 'HTTP/1.1'
+
+    # Headers and body are written separately; without this, Nagle's
+    # algorithm and delayed ACKs add ~40 ms to every response
+    disable_nagle_algorithm = True
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.server._delay()
+        status, headers, payload = self.server.route(self.command, self.path, dict(self.headers), body)
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeSmtpServer(socketserver.ThreadingTCPServer):
+    """Plain-text SMTP server standing in for smtp.gmail.com
+
+    Offers PIPELINING and AUTH XOAUTH2 (any bearer token is accepted) and
+    keeps every message it receives. latency is added to each message after
+    its data arrives; error_rate is the fraction answered with a 451.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, latency=0.0, error_rate=0.0):
+        super().__init__(('127.0.0.1', port), FakeSmtpHandler)
+        self.host, self.port = self.server_address
+        self.latency = latency
+        self.error_rate = error_rate
+        self.sent = []
+        self.counts = {'sessions': 0, 'send': 0, 'errors': 0}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Serve from a daemon thread and return self"""
+        threading.Thread(target=self.serve_forever, name='fake-smtp', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def deliver(self, envelope, data):
+        """Accept or fail one message and return the reply line"""
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.error_rate:
+            self._count('errors')
+            return '451 4.3.0 Temporary System Problem. Try again later.'
+        with self._lock:
+            message_id = f'{next(self._ids):016x}'
+            self.sent.append((envelope, data))
+            self.counts['send'] += 1
+        return f'250 2.0.0 OK {message_id} - gsmtp'
+
+class FakeSmtpHandler(socketserver.StreamRequestHandler):
+    """Speaks enough SMTP for gmail_transports.SmtpTransport"""
+
+    disable_nagle_algorithm = True
+
+    def _reply(self, line):
+        self.wfile.write(line.encode() + b'\r\n')
+
+    def handle(self):
+        server = self.server
+        server._count('sessions')
+        self._reply('220 fake.smtp.gmail.com ESMTP ready')
+        authenticated = False
+        envelope = None
+
+        for raw in self.rfile:
+            line = raw.decode('utf-8', 'replace').rstrip('\r\n')
+            verb = line.split(' ', 1)[0].upper()
+
+            if verb in ('EHLO', 'HELO'):
+                self.wfile.write(b'250-fake.smtp.gmail.com\r\n250-PIPELINING\r\n'
+                                 b'250-8BITMIME\r\n250 AUTH XOAUTH2\r\n')
+            elif verb == 'AUTH':
+                authenticated = 'XOAUTH2' in line.upper()
+                self._reply('235 2.7.0 Accepted' if authenticated else '504 5.7.4 Unrecognized auth type')
+            elif verb == 'NOOP':
+                self._reply('250 2.0.0 OK')
+            elif verb == 'RSET':
+                envelope = None
+                self._reply('250 2.1.5 Flushed')
+            elif verb == 'QUIT':
+                self._reply('221 2.0.0 closing connection')
+                return
+            elif not authenticated:
+                self._reply('530 5.7.0 Authentication Required')
+            elif verb == 'MAIL':
+                envelope = {'from': line[10:].strip('<>'), 'to': []}
+                self._reply('250 2.1.0 OK')
+            elif verb == 'RCPT' and envelope is not None:
+                envelope['to'].append(line[8:].strip('<>'))
+                self._reply('250 2.1.5 OK')
+            elif verb == 'DATA' and envelope and envelope['to']:
+                self._reply('354 Go ahead')
+                data = bytearray()
+                for data_line in self.rfile:
+                    if data_line == b'.\r\n':
+                        break
+                    data.extend(data_line[1:] if data_line.startswith(b'..') else data_line)
+                self._reply(server.deliver(envelope, bytes(data)))
+                envelope = None
+            else:
+                self._reply('503 5.5.1 Bad sequence of commands')
+
+def main():
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8099
+    server = FakeGmailServer(port=port)
+    print(f"Fake Gmail API listening on {server.base_url}")
+    print(f"   GMAIL_DISCOVERY_URL={server.discovery_url}")
+    print(f"   token_uri={server.token_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopped")
+
+if __name__ == '__main__':
+    main()
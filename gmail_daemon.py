@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Gmail Send Daemon
+Keeps credentials, Gmail services and HTTP connections warm and accepts send
+jobs over a loopback HTTP API
+"""
+
+import hmac
+import http.server
+import json
+import os
+import secrets
+import signal
+import sys
+import threading
+import urllib.error
+import urllib.request
+
+from email_templates import load_template
+from priority_lanes import DEFAULT_LANE, LaneScheduler
+
+# The Google client libraries load in main() and on the first job, so that
+# clients calling send_via_daemon stay cheap to start
+
+# Loopback port the daemon listens on
+DAEMON_PORT = 8765
+
+# Overrides the daemon URL for clients
+DAEMON_URL_ENV = 'GMAIL_DAEMON_URL'
+
+# Seconds to wait for in-flight sends when shutting down
+DRAIN_TIMEOUT = 30
+
+# Largest job body accepted, in bytes
+MAX_JOB_BYTES = 10 * 1024 * 1024
+
+# Secret clients must present as a bearer token, rewritten on every start;
+# readable by the owner only, like token.json next to it
+DAEMON_TOKEN_PATH = 'gmail_daemon.token'
+
+# Jobs may only name templates with this suffix in the daemon's template directory
+TEMPLATE_SUFFIX = '.txt'
+
+class DaemonError(Exception):
+    """The daemon rejected a job or could not send it
+
+    maybe_sent is True when the message may have gone out anyway: Gmail
+    failed the send, or the daemon's answer never arrived.
+    """
+
+    def __init__(self, message, maybe_sent=False):
+        super().__init__(message)
+        self.maybe_sent = maybe_sent
+
+class SendDaemon(http.server.ThreadingHTTPServer):
+    """Loopback HTTP server that sends jobs through a warm ConcurrentSender
+
+    POST /send takes {"recipients": [...], "subject": ..., "body": ...,
+    "headers": {...}} or {"recipients": [...], "template": path,
+    "context": {...}}, plus an optional "lane" (transactional, normal or
+    bulk, see priority_lanes), and answers with the Gmail API response.
+    Templates are file names looked up in template_dir (the working
+    directory by default), never paths. GET /health reports counts and
+    per-lane queue depth and latency. POST /shutdown and SIGTERM stop
+    accepting jobs, wait for in-flight sends and exit.
+
+    Every request must carry the secret from token_path as a bearer token,
+    POST bodies must be application/json, and requests with an Origin
+    header are refused, so web pages in the user's browser cannot drive
+    the daemon.
+    """
+
+    daemon_threads = True
+
+    # Lanes queue jobs in the daemon, so let clients connect in bursts
+    # instead of being reset at the default listen backlog of 5
+    request_queue_size = 128
+
+    def __init__(self, sender, sender_email, port=DAEMON_PORT, token_path=DAEMON_TOKEN_PATH,
+                 template_dir=None):
+        super().__init__(('127.0.0.1', port), DaemonHandler)
+        # Written only once the port is ours, so a second daemon that fails
+        # to bind leaves the running one's token alone
+        self.token = secrets.token_urlsafe(32)
+        self.token_path = token_path
+        write_daemon_token(token_path, self.token)
+        self.template_dir = os.path.realpath(template_dir or os.getcwd())
+        self.sender = sender
+        self.lanes = LaneScheduler(sender)
+        self.sender_email = sender_email
+        self.url = f'http://127.0.0.1:{self.server_address[1]}'
+        self.draining = False
+        self.stopping = threading.Event()
+        self.stats = {'sent': 0, 'failed': 0, 'in_flight': 0}
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def server_close(self):
+        super().server_close()
+        if read_daemon_token(self.token_path) == self.token:
+            os.remove(self.token_path)
+
+    def authorized(self, header):
+        """Return True if an Authorization header value carries this daemon's token"""
+        return hmac.compare_digest((header or '').encode(), f'Bearer {self.token}'.encode())
+
+    def _template_path(self, name):
+        """Resolve a job's template name inside template_dir; raises ValueError otherwise"""
+        if (not isinstance(name, str) or os.path.isabs(name) or os.path.basename(name) != name
+                or not name.endswith(TEMPLATE_SUFFIX)):
+            raise ValueError(f'template must be a {TEMPLATE_SUFFIX} file name, not a path')
+        path = os.path.realpath(os.path.join(self.template_dir, name))
+        if os.path.dirname(path) != self.template_dir or not os.path.isfile(path):
+            raise ValueError(f'Unknown template {name!r}')
+        return path
+
+    def _message(self, job):
+        """Render and encode the Gmail API message for one job"""
+        from send_gmail_oauth import create_message
+
+        recipients = job.get('recipients')
+        if not recipients or not isinstance(recipients, list):
+            raise ValueError('recipients must be a non-empty list')
+
+        if job.get('template'):
+            content = load_template(self._template_path(job['template'])).render(job.get('context') or {})
+            subject, body, headers = content.subject, content.body, content.headers
+        else:
+            subject, body, headers = job.get('subject'), job.get('body'), job.get('headers')
+            if subject is None or body is None:
+                raise ValueError('subject and body are required without a template')
+        return create_message(self.sender_email, recipients, subject, body, headers)
+
+    def send(self, job):
+        """Send one job and return the API response; raises DaemonError while draining"""
+        lane = job.get('lane') or DEFAULT_LANE
+        if lane not in self.lanes.lanes:
+            raise ValueError(f"Unknown lane {lane!r}; use {', '.join(self.lanes.lanes)}")
+        with self._lock:
+            if self.draining:
+                raise DaemonError('Daemon is shutting down')
+            self.stats['in_flight'] += 1
+
+        outcome = 'failed'
+        try:
+            result = self.lanes.submit(self._message(job), lane).result()
+            outcome = 'sent'
+            return result
+        finally:
+            with self._lock:
+                self.stats['in_flight'] -= 1
+                self.stats[outcome] += 1
+                self._idle.notify_all()
+
+    def health(self):
+        with self._lock:
+            return dict(self.stats, sender=self.sender_email, draining=self.draining,
+                        lanes=self.lanes.stats())
+
+    def drain(self, timeout=DRAIN_TIMEOUT):
+        """Refuse new jobs and wait for in-flight ones; returns True if all finished"""
+        with self._lock:
+            self.draining = True
+            return self._idle.wait_for(lambda: self.stats['in_flight'] == 0, timeout)
+
+    def serve(self):
+        """Serve until SIGTERM, SIGINT or POST /shutdown, then drain and stop"""
+        thread = threading.Thread(target=self.serve_forever, name='gmail-daemon', daemon=True)
+        thread.start()
+
+        def request_stop(signum, frame):
+            self.stopping.set()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        self.stopping.wait()
+
+        print("Draining in-flight sends...")
+        if not self.drain():
+            print(f"Gave up waiting after {DRAIN_TIMEOUT}s with {self.stats['in_flight']} send(s) in flight")
+        self.shutdown()
+        self.server_close()
+        thread.join()
+        self.lanes.close()
+
+class DaemonHandler(http.server.BaseHTTPRequestHandler):
+    """Routes daemon requests to SendDaemon"""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _refuse(self, status, message):
+        # The body, if any, is left unread, so the connection cannot be reused
+        self.close_connection = True
+        self._reply(status, {'error': message})
+
+    def _allowed(self):
+        """Check origin and token, replying with an error if the request is refused"""
+        if self.headers.get('Origin') is not None:
+            self._refuse(403, 'Cross-origin requests are refused')
+            return False
+        if not self.server.authorized(self.headers.get('Authorization')):
+            self._refuse(401, f'Missing or wrong daemon token (see {self.server.token_path})')
+            return False
+        return True
+
+    def do_GET(self):
+        if not self._allowed():
+            return
+        if self.path == '/health':
+            self._reply(200, self.server.health())
+        else:
+            self._reply(404, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        if not self._allowed():
+            return
+        content_type = (self.headers.get('Content-Type') or '').split(';')[0].strip().lower()
+        if content_type != 'application/json':
+            self._refuse(415, 'Content-Type must be application/json')
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_JOB_BYTES:
+            self._refuse(413, 'Job too large')
+            return
+        body = self.rfile.read(length) if length else b''
+
+        if self.path == '/shutdown':
+            self._reply(202, {'status': 'draining'})
+            self.server.stopping.set()
+            return
+        if self.path != '/send':
+            self._reply(404, {'error': f'Unknown path {self.path}'})
+            return
+
+        try:
+            job = json.loads(body or b'{}')
+            result = self.server.send(job)
+        except (ValueError, KeyError) as error:
+            self._reply(400, {'error': str(error)})
+        except DaemonError as error:
+            self._reply(503, {'error': str(error)})
+        except Exception as error:
+            self._reply(502, {'error': str(error)})
+        else:
+            self._reply(200, result)
+
+    def log_message(self, format, *args):
+        pass
+
+def write_daemon_token(path, token):
+    """Write token to path, readable and writable by the owner only"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        # O_CREAT only applies the mode to new files
+        os.fchmod(f.fileno(), 0o600)
+        f.write(token)
+
+def read_daemon_token(path=DAEMON_TOKEN_PATH):
+    """Return the running daemon's token, or None if there is none"""
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+def daemon_url():
+    return os.environ.get(DAEMON_URL_ENV, f'http://127.0.0.1:{DAEMON_PORT}')
+
+def daemon_available(url=None, timeout=0.5, token_path=DAEMON_TOKEN_PATH):
+    """Return True if a daemon is answering at url and accepts our token"""
+    token = read_daemon_token(token_path)
+    if token is None:
+        return False
+    request = urllib.request.Request(
+        f'{url or daemon_url()}/health', headers={'Authorization': f'Bearer {token}'})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return not json.load(response).get('draining')
+    except (OSError, ValueError):
+        return False
+
+def send_via_daemon(recipients, subject=None, body=None, headers=None, template=None, context=None,
+                    url=None, timeout=120, lane=None, token_path=DAEMON_TOKEN_PATH):
+    """Send one message through a running daemon and return the Gmail API response
+
+    Pass subject and body, or the file name of a template in the daemon's
+    template directory, rendered by the daemon with context, and the
+    priority lane to queue it in. Raises DaemonError if no daemon is
+    running or it refuses or fails the job.
+    """
+    url = url or daemon_url()
+    token = read_daemon_token(token_path)
+    if token is None:
+        raise DaemonError(f'No daemon token at {token_path}')
+    job = {'recipients': recipients, 'lane': lane or DEFAULT_LANE}
+    if template:
+        job.update(template=template, context=context or {})
+    else:
+        job.update(subject=subject, body=body, headers=headers or {})
+
+    request = urllib.request.Request(
+        f'{url}/send', data=json.dumps(job).encode(),
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.load(response)
+    except urllib.error.HTTPError as error:
+        try:
+            message = json.load(error).get('error', error.reason)
+        except ValueError:
+            message = error.reason
+        # 502 is the daemon passing on a failed Gmail send
+        raise DaemonError(message, maybe_sent=error.code == 502) from None
+    except urllib.error.URLError as error:
+        raise DaemonError(f'No daemon answering at {url}: {error.reason}') from None
+    except OSError as error:
+        raise DaemonError(f'Lost the daemon at {url} mid-send: {error}', maybe_sent=True) from None
+
+def main():
+    from automated_gmail_sender import authenticate_gmail_automated
+    from concurrent_gmail_sender import ConcurrentSender
+    from gmail_discovery import build_gmail_service
+    from gmail_rate_limiter import RateLimiter
+    from sender_identity import cached_sender_email
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else DAEMON_PORT
+
+    creds = authenticate_gmail_automated()
+    if not creds:
+        print("Authentication failed")
+        return 1
+
+    sender_email = cached_sender_email(build_gmail_service(creds), creds)
+
+    with ConcurrentSender(creds, limiter=RateLimiter()) as sender:
+        daemon = SendDaemon(sender, sender_email, port=port)
+        print(f"Gmail daemon for {sender_email} listening on {daemon.url}")
+        daemon.serve()
+        health = daemon.health()
+
+    print(f"Stopped: {health['sent']} sent, {health['failed']} failed")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Gmail Discovery Cache
+Builds Gmail service objects from an on-disk cache of the discovery document
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from googleapiclient.version import __version__ as CLIENT_VERSION
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.discovery_cache.base import Cache
+
+from gmail_metrics import phase
+
+# Bump when the layout of cached entries changes to invalidate old ones
+CACHE_VERSION = 1
+
+# Cached documents older than this are treated as missing
+CACHE_TTL = 7 * 24 * 60 * 60
+
+CACHE_DIR = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')),
+    'gmail-email-setup', 'discovery')
+
+# Set to fetch discovery from a live endpoint instead of the bundled document
+DISCOVERY_URL_ENV = 'GMAIL_DISCOVERY_URL'
+
+# API methods used by the scripts in this repository; everything else is
+# dropped from the trimmed document so it parses in a fraction of the time
+USED_METHODS = {
+    'users': ['getProfile'],
+    'users.messages': ['send'],
+    'users.drafts': ['create', 'get', 'send', 'delete', 'list'],
+    'users.labels': ['list'],
+}
+
+def _entry_path(key):
+    """Return the cache file path for a key"""
+    digest = hashlib.sha256(key.encode()).hexdigest()[:32]
+    return os.path.join(CACHE_DIR, f'{digest}.json')
+
+def _read_entry(key, ttl):
+    """Return cached content for key, or None if missing, stale or from another version"""
+    try:
+        with open(_entry_path(key), 'r') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if entry.get('cache_version') != CACHE_VERSION:
+        return None
+    if entry.get('client_version') != CLIENT_VERSION:
+        return None
+    if entry.get('key') != key or time.time() - entry.get('created', 0) > ttl:
+        return None
+    return entry['content']
+
+def _write_entry(key, content):
+    """Atomically store content for key"""
+    path = _entry_path(key)
+    entry = {
+        'cache_version': CACHE_VERSION,
+        'client_version': CLIENT_VERSION,
+        'key': key,
+        'created': time.time(),
+        'content': content,
+    }
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, path)
+    except OSError as error:
+        print(f'Could not write discovery cache: {error}')
+
+class DiscoveryFileCache(Cache):
+    """Persistent discovery cache for documents fetched over the network"""
+
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+
+    def get(self, url):
+        return _read_entry(f'url:{url}', self.ttl)
+
+    def set(self, url, content):
+        _write_entry(f'url:{url}', content)
+
+def clear_discovery_cache():
+    """Remove every cached discovery document"""
+    if not os.path.isdir(CACHE_DIR):
+        return 0
+
+    removed = 0
+    for name in os.listdir(CACHE_DIR):
+        if name.endswith('.json'):
+            os.remove(os.path.join(CACHE_DIR, name))
+            removed += 1
+    return removed
+
+def _referenced_schemas(value, schemas, found):
+    """Collect the names of schemas referenced from value, recursively"""
+    if isinstance(value, dict):
+        ref = value.get('$ref')
+        if ref and ref not in found and ref in schemas:
+            found.add(ref)
+            _referenced_schemas(schemas[ref], schemas, found)
+        for item in value.values():
+            _referenced_schemas(item, schemas, found)
+    elif isinstance(value, list):
+        for item in value:
+            _referenced_schemas(item, schemas, found)
+    return found
+
+def trim_discovery_document(document, used_methods=USED_METHODS):
+    """Return a copy of document containing only used_methods and their schemas"""
+    trimmed = {key: value for key, value in document.items()
+               if key not in ('resources', 'methods', 'schemas')}
+    trimmed['resources'] = {}
+
+    for path, method_names in used_methods.items():
+        source = document
+        target = trimmed
+        for name in path.split('.'):
+            source = source['resources'][name]
+            target = target.setdefault('resources', {}).setdefault(name, {})
+        target['methods'] = {name: source['methods'][name] for name in method_names}
+
+    schemas = document.get('schemas', {})
+    found = _referenced_schemas(trimmed['resources'], schemas, set())
+    trimmed['schemas'] = {name: schemas[name] for name in sorted(found)}
+    return trimmed
+
+def load_static_document(ttl=CACHE_TTL):
+    """Return the trimmed bundled Gmail discovery document, from cache if possible"""
+    key = f'static:gmail:v1:{sorted(USED_METHODS.items())}'
+    content = _read_entry(key, ttl)
+    if content is not None:
+        return content
+
+    document = trim_discovery_document(json.loads(get_static_doc('gmail', 'v1')))
+    _write_entry(key, document)
+    return document
+
+def build_gmail_service(credentials=None, http=None, discovery_url=None):
+    """Build a Gmail service object without fetching or fully parsing discovery
+
+    By default the service is built from a trimmed copy of the discovery
+    document bundled with googleapiclient. When discovery_url (or the
+    GMAIL_DISCOVERY_URL environment variable) is set, the document is fetched
+    from that URL once and then served from the on-disk cache.
+    """
+    discovery_url = discovery_url or os.environ.get(DISCOVERY_URL_ENV)
+    with phase('build'):
+        if discovery_url:
+            return build('gmail', 'v1', credentials=credentials, http=http,
+                         discoveryServiceUrl=discovery_url, static_discovery=False,
+                         cache=DiscoveryFileCache())
+
+        return build_from_document(load_static_document(), credentials=credentials, http=http)
+
+if __name__ == '__main__':
+    print(f"Removed {clear_discovery_cache()} cached discovery document(s) from {CACHE_DIR}")
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Gmail Metrics
+Lightweight per-phase timing with Prometheus text or JSON export at exit
+"""
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+# Set to 'prometheus' or 'json' to record metrics and export them at exit
+METRICS_ENV = 'GMAIL_METRICS'
+
+# Optional file for the export; defaults to stderr
+METRICS_FILE_ENV = 'GMAIL_METRICS_FILE'
+
+# Latency histogram bucket upper bounds in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class _NullTimer:
+    """Context manager that does nothing, handed out while metrics are disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _PhaseTimer:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start, failed=exc_type is not None)
+        return False
+
+class _Histogram:
+    def __init__(self):
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+
+class Metrics:
+    """Counters and per-phase latency histograms
+
+    phase(name) returns a context manager timing the block it wraps. While
+    disabled it returns one shared no-op object, so instrumented code pays
+    only a function call.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def phase(self, name):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _PhaseTimer(self, name)
+
+    def observe(self, name, seconds, failed=False):
+        """Record one timed call of phase name"""
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = _Histogram()
+            histogram.observe(seconds)
+            if failed:
+                key = f'{name}_errors'
+                self._counters[key] = self._counters.get(key, 0) + 1
+
+    def incr(self, name, value=1):
+        """Add value to counter name"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def prometheus_text(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            if self._histograms:
+                lines.append('# HELP gmail_phase_seconds Time spent in each sending phase')
+                lines.append('# TYPE gmail_phase_seconds histogram')
+            for name, histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.bucket_counts):
+                    cumulative += count
+                    lines.append(f'gmail_phase_seconds_bucket{{phase="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'gmail_phase_seconds_bucket{{phase="{name}",le="+Inf"}} {histogram.count}')
+                lines.append(f'gmail_phase_seconds_sum{{phase="{name}"}} {histogram.sum:.6f}')
+                lines.append(f'gmail_phase_seconds_count{{phase="{name}"}} {histogram.count}')
+
+            for name, value in sorted(self._counters.items()):
+                lines.append(f'# TYPE gmail_{name}_total counter')
+                lines.append(f'gmail_{name}_total {value}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Return a JSON-serializable summary of all metrics"""
+        with self._lock:
+            phases = {
+                name: {
+                    'count': histogram.count,
+                    'total_seconds': round(histogram.sum, 6),
+                    'mean_seconds': round(histogram.sum / histogram.count, 6),
+                    'max_seconds': round(histogram.max, 6),
+                }
+                for name, histogram in sorted(self._histograms.items())
+            }
+            return {'phases': phases, 'counters': dict(sorted(self._counters.items()))}
+
+    def export(self, fmt):
+        """Write metrics in fmt ('prometheus' or 'json') to GMAIL_METRICS_FILE or stderr"""
+        if fmt == 'json':
+            text = json.dumps(self.summary(), indent=2) + '\n'
+        else:
+            text = self.prometheus_text()
+
+        path = os.environ.get(METRICS_FILE_ENV)
+        if path:
+            with open(path, 'w') as f:
+                f.write(text)
+        else:
+            sys.stderr.write(text)
+
+_format = os.environ.get(METRICS_ENV, '').strip().lower()
+
+metrics = Metrics(enabled=bool(_format))
+phase = metrics.phase
+incr = metrics.incr
+
+if metrics.enabled:
+    atexit.register(metrics.export, _format)
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Gmail Outbox
+Durable SQLite-backed queue of prepared messages with at-least-once delivery
+"""
+
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import time
+
+from automated_gmail_sender import authenticate_gmail_automated
+from gmail_discovery import build_gmail_service
+from gmail_rate_limiter import RateLimiter, backoff_delay, send_with_rate_limit
+from gmail_retry import PERMANENT, RetryPolicy, classify
+
+OUTBOX_PATH = 'outbox.db'
+
+# Overrides OUTBOX_PATH; set it empty to send directly instead of through the outbox
+OUTBOX_PATH_ENV = 'GMAIL_OUTBOX_PATH'
+
+# Seconds a worker may hold a message before another worker can take it over
+LEASE_SECONDS = 300
+
+# Attempts before a message is marked as permanently failed
+MAX_ATTEMPTS = 8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    message TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    leased_by TEXT,
+    lease_expires REAL,
+    gmail_id TEXT,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS outbox_ready ON outbox (status, available_at);
+"""
+
+class Outbox:
+    """Persistent queue of prepared {'raw': ...} messages
+
+    Producers enqueue() messages; workers lease() a batch, send them and
+    report back with mark_sent() or mark_failed(). A lease that is not
+    resolved in time (the worker died) expires and the message is handed
+    out again, so every message is delivered at least once. Each lease
+    counts as an attempt, so a message that keeps killing its workers is
+    failed after max_attempts leases. Only the worker holding a lease can
+    resolve it.
+    """
+
+    def __init__(self, path=OUTBOX_PATH, lease_seconds=LEASE_SECONDS,
+                 max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def enqueue(self, message, user_id='me'):
+        """Store a prepared message and return its outbox ID"""
+        return self.enqueue_many([message], user_id)[0]
+
+    def enqueue_many(self, messages, user_id='me'):
+        """Store prepared messages in one transaction and return their outbox IDs"""
+        now = time.time()
+        ids = []
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            for message in messages:
+                cursor = self.conn.execute(
+                    'INSERT INTO outbox (user_id, message, available_at, created_at) '
+                    'VALUES (?, ?, ?, ?)',
+                    (user_id, json.dumps(message), now, now))
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def lease(self, worker_id, limit=50):
+        """Claim up to limit ready messages for worker_id
+
+        Returns a list of (outbox_id, user_id, message) tuples. Messages whose
+        previous lease has expired are included.
+        """
+        now = time.time()
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.execute(
+                "UPDATE outbox SET status = 'failed', last_error = ?, leased_by = NULL, lease_expires = NULL "
+                "WHERE status = 'leased' AND lease_expires <= ? AND attempts >= ?",
+                (f'Lease expired after {self.max_attempts} attempts', now, self.max_attempts))
+            rows = self.conn.execute(
+                "SELECT id, user_id, message FROM outbox "
+                "WHERE (status = 'pending' AND available_at <= ?) "
+                "   OR (status = 'leased' AND lease_expires <= ?) "
+                "ORDER BY id LIMIT ?",
+                (now, now, limit)).fetchall()
+            self.conn.executemany(
+                "UPDATE outbox SET status = 'leased', leased_by = ?, lease_expires = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                [(worker_id, now + self.lease_seconds, row[0]) for row in rows])
+        return [(row[0], row[1], json.loads(row[2])) for row in rows]
+
+    def mark_sent(self, outbox_id, worker_id, gmail_id):
+        """Record a successful send with the Gmail message ID
+
+        Returns False if worker_id no longer holds the lease; the message was
+        then handed to another worker after this one's lease expired.
+        """
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE outbox SET status = 'sent', gmail_id = ?, sent_at = ?, "
+                "leased_by = NULL, lease_expires = NULL "
+                "WHERE id = ? AND status = 'leased' AND leased_by = ?",
+                (gmail_id, time.time(), outbox_id, worker_id))
+        return cursor.rowcount == 1
+
+    def mark_failed(self, outbox_id, worker_id, error, retry=True):
+        """Record a failed attempt and schedule a retry with backoff
+
+        The message is marked 'failed' for good once it has used up its
+        attempts or when retry is False (a permanent error). Returns False,
+        changing nothing, if worker_id no longer holds the lease.
+        """
+        with self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            row = self.conn.execute(
+                "SELECT attempts FROM outbox WHERE id = ? AND status = 'leased' AND leased_by = ?",
+                (outbox_id, worker_id)).fetchone()
+            if row is None:
+                return False
+            attempts = row[0]
+            if retry and attempts < self.max_attempts:
+                status = 'pending'
+                available_at = time.time() + backoff_delay(attempts)
+            else:
+                status = 'failed'
+                available_at = time.time()
+            self.conn.execute(
+                "UPDATE outbox SET status = ?, available_at = ?, last_error = ?, "
+                "leased_by = NULL, lease_expires = NULL WHERE id = ?",
+                (status, available_at, str(error), outbox_id))
+        return True
+
+    def results(self, outbox_ids):
+        """Return {outbox_id: (status, gmail_id, last_error)} for outbox_ids"""
+        marks = ','.join('?' * len(outbox_ids))
+        rows = self.conn.execute(
+            f'SELECT id, status, gmail_id, last_error FROM outbox WHERE id IN ({marks})', list(outbox_ids))
+        return {row[0]: row[1:] for row in rows}
+
+    def counts(self):
+        """Return the number of messages in each status"""
+        return dict(self.conn.execute(
+            'SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+
+def default_worker_id():
+    """Identify this worker process by host and PID"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+def outbox_path():
+    """Return the path of the outbox the send scripts share, '' when disabled"""
+    return os.environ.get(OUTBOX_PATH_ENV, OUTBOX_PATH)
+
+def open_outbox():
+    """Open the outbox the send scripts share, or a null context when disabled"""
+    path = outbox_path()
+    return Outbox(path) if path else contextlib.nullcontext()
+
+class OutboxError(Exception):
+    """A message put through the outbox was not sent by the drain"""
+
+def send_through_outbox(service, outbox, message, user_id='me', limiter=None, retry=None):
+    """Enqueue a prepared message, drain the outbox and return its API response
+
+    The message is stored before anything is sent, so if this process dies
+    it is still sent by the next drain (this one, or gmail_outbox.py).
+    Messages left over from earlier runs go out in the same drain. Raises
+    OutboxError if the message failed, or is waiting to be retried.
+    """
+    outbox_id = outbox.enqueue(message, user_id)
+    run_worker(service, outbox, limiter=limiter, retry=retry)
+    status, gmail_id, last_error = outbox.results([outbox_id])[outbox_id]
+    if status == 'pending':
+        raise OutboxError(f'Outbox message {outbox_id} is waiting to be retried ({last_error}); '
+                          'python3 gmail_outbox.py sends it')
+    if status != 'sent':
+        raise OutboxError(f'Outbox message {outbox_id} is {status}: {last_error}')
+    return {'id': gmail_id}
+
+def run_worker(service, outbox, worker_id=None, batch_size=50, limiter=None,
+               idle_sleep=1.0, stop_when_empty=True, retry=None):
+    """Send messages from the outbox until it is drained
+
+    Returns the number of messages sent. Sends go through the rate limiter
+    when one is given, which then also handles throttling; a message is
+    only marked sent after Gmail returns its ID, so a crash in between means
+    it will be sent again.
+    """
+    worker_id = worker_id or default_worker_id()
+    retry = retry or RetryPolicy(retry_throttled=limiter is None)
+    sent = 0
+    while True:
+        leased = outbox.lease(worker_id, batch_size)
+        if not leased:
+            if stop_when_empty:
+                return sent
+            time.sleep(idle_sleep)
+            continue
+
+        for outbox_id, user_id, message in leased:
+            try:
+                if limiter is not None:
+                    result = retry.call(lambda: send_with_rate_limit(service, user_id, message, limiter))
+                else:
+                    result = retry.call(
+                        lambda: service.users().messages().send(userId=user_id, body=message).execute())
+            except Exception as error:
+                # Permanent errors will fail the same way again
+                print(f'Outbox message {outbox_id} failed: {error}')
+                if not outbox.mark_failed(outbox_id, worker_id, error, retry=classify(error) != PERMANENT):
+                    print(f'Outbox message {outbox_id}: lease lost, left to its new worker')
+                continue
+
+            if not outbox.mark_sent(outbox_id, worker_id, result['id']):
+                print(f'Outbox message {outbox_id}: lease lost before it was marked sent')
+            sent += 1
+            print(f'Outbox message {outbox_id} sent! Message ID: {result["id"]}')
+
+def main():
+    with Outbox(outbox_path() or OUTBOX_PATH) as outbox:
+        print(f"Outbox status: {outbox.counts() or 'empty'}")
+
+        creds = authenticate_gmail_automated()
+        if not creds:
+            print("Authentication failed")
+            return
+
+        service = build_gmail_service(creds)
+        sent = run_worker(service, outbox, limiter=RateLimiter())
+        print(f"Sent {sent} message(s). Outbox status: {outbox.counts()}")
+
+if __name__ == '__main__':
+    main()
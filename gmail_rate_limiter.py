@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Gmail Rate Limiter
+Quota-aware token bucket with adaptive backoff for Gmail API calls
+"""
+
+import email.utils
+import json
+import random
+import threading
+import time
+
+from googleapiclient.errors import HttpError
+
+# Quota units charged per call, from the Gmail API usage limits
+QUOTA_UNITS = {
+    'messages.send': 100,
+    'drafts.create': 10,
+    'drafts.send': 100,
+    'drafts.delete': 10,
+    'drafts.list': 5,
+    'getProfile': 1,
+    'labels.list': 1,
+}
+
+# Per-user rate limit in quota units per second
+USER_QUOTA_PER_SECOND = 250
+
+# Error reasons Gmail uses for throttling alongside HTTP 429
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+
+# Adaptive rate: halve on throttling, recover a little after each success
+DECREASE_FACTOR = 0.5
+INCREASE_FRACTION = 0.02
+MIN_RATE_FRACTION = 0.05
+
+# Exponential backoff bounds in seconds
+BACKOFF_BASE = 1
+BACKOFF_CAP = 64
+
+MAX_RETRIES = 5
+
+def error_reasons(error):
+    """Return the reason strings from a Gmail API HttpError body"""
+    try:
+        data = json.loads(error.content.decode('utf-8'))
+        return [detail.get('reason') for detail in data['error'].get('errors', [])]
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return []
+
+def is_rate_limit_error(error):
+    """Return True if error is Gmail telling us to slow down"""
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status == 429:
+        return True
+    return error.resp.status == 403 and any(
+        reason in RATE_LIMIT_REASONS for reason in error_reasons(error))
+
+def retry_after_seconds(error):
+    """Return the Retry-After delay of an HttpError in seconds, or None"""
+    value = error.resp.get('retry-after') if isinstance(error, HttpError) else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Exponential backoff with full jitter for a zero-based attempt number"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def throttle_delay(error, attempt):
+    """Seconds to wait before retrying a throttled call"""
+    retry_after = retry_after_seconds(error)
+    delay = backoff_delay(attempt)
+    return max(delay, retry_after) if retry_after is not None else delay
+
+class RateLimiter:
+    """Token bucket metered in Gmail quota units
+
+    The bucket refills at the current rate, which starts at the configured
+    limit, is cut whenever Gmail throttles us and creeps back up on success,
+    so senders settle just under the real limit. Thread-safe; reserve() never
+    sleeps itself so asyncio callers can await the returned delay instead.
+    """
+
+    def __init__(self, units_per_second=USER_QUOTA_PER_SECOND, burst=None):
+        self.max_rate = units_per_second
+        self.min_rate = units_per_second * MIN_RATE_FRACTION
+        self.rate = units_per_second
+        self.capacity = burst or units_per_second
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, units):
+        """Take units from the bucket and return how long to wait before using them"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= units
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def acquire(self, units):
+        """Block until units of quota are available"""
+        delay = self.reserve(units)
+        if delay > 0:
+            time.sleep(delay)
+
+    def on_success(self):
+        """Additively raise the rate back towards the configured limit"""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * INCREASE_FRACTION)
+
+    def on_throttle(self, retry_after=None):
+        """Cut the rate after a throttling error and honour any Retry-After"""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate * DECREASE_FACTOR)
+            self.tokens = min(self.tokens, 0)
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+
+def execute_with_rate_limit(execute, limiter, units, max_retries=MAX_RETRIES):
+    """Call execute() through the limiter, charging units, retrying when throttled
+
+    Returns the API response. Errors that are not throttling, and throttling
+    that persists after max_retries retries, are raised to the caller.
+    """
+    for attempt in range(max_retries + 1):
+        limiter.acquire(units)
+        try:
+            result = execute()
+        except HttpError as error:
+            if not is_rate_limit_error(error) or attempt == max_retries:
+                raise
+            limiter.on_throttle(retry_after_seconds(error))
+            time.sleep(throttle_delay(error, attempt))
+            continue
+
+        limiter.on_success()
+        return result
+
+def send_with_rate_limit(service, user_id, message, limiter, max_retries=MAX_RETRIES):
+    """Send one message through the limiter, retrying when throttled"""
+    return execute_with_rate_limit(
+        lambda: service.users().messages().send(userId=user_id, body=message).execute(),
+        limiter, QUOTA_UNITS['messages.send'], max_retries)
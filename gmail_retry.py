@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Gmail Retry Engine
+Classified retries with capped backoff and a shared circuit breaker for
+send, token refresh and profile calls
+"""
+
+import http.client
+import smtplib
+import socket
+import ssl
+import threading
+import time
+
+import httplib2
+from google.auth.exceptions import RefreshError, TransportError
+from google.auth.transport.requests import Request
+from googleapiclient.errors import HttpError
+
+from gmail_metrics import incr
+from gmail_rate_limiter import (
+    BACKOFF_CAP, MAX_RETRIES, backoff_delay, is_rate_limit_error, throttle_delay)
+
+# Error classes
+TRANSIENT = 'transient'
+THROTTLED = 'throttled'
+PERMANENT = 'permanent'
+
+# HTTP statuses worth retrying besides the 5xx range
+RETRYABLE_STATUSES = (408,)
+
+# Network failures, including connections closed mid-response (EOFError
+# covers asyncio.IncompleteReadError)
+NETWORK_ERRORS = (ConnectionError, TimeoutError, EOFError, socket.gaierror, ssl.SSLError,
+                  http.client.HTTPException, httplib2.HttpLib2Error, TransportError)
+
+# Consecutive transient failures that open the circuit, and how long it
+# stays open before one probe call is let through
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30
+
+# How often callers blocked behind an in-flight probe look again
+PROBE_POLL = 0.5
+
+def classify(error):
+    """Return TRANSIENT, THROTTLED or PERMANENT for an exception"""
+    if is_rate_limit_error(error):
+        return THROTTLED
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        return TRANSIENT if status >= 500 or status in RETRYABLE_STATUSES else PERMANENT
+    if isinstance(error, RefreshError):
+        # invalid_grant and friends will not fix themselves
+        return TRANSIENT if getattr(error, 'retryable', False) else PERMANENT
+    if isinstance(error, smtplib.SMTPResponseException):
+        # 4xx replies (421 closing, 450/451/452 try later) are temporary
+        return TRANSIENT if 400 <= error.smtp_code < 500 else PERMANENT
+    if isinstance(error, (smtplib.SMTPServerDisconnected, *NETWORK_ERRORS)):
+        return TRANSIENT
+    return PERMANENT
+
+class CircuitOpenError(Exception):
+    """The circuit stayed open longer than the caller was willing to wait"""
+
+class CircuitBreaker:
+    """Stops all callers from hammering an API that is down
+
+    After failure_threshold consecutive transient failures the circuit
+    opens and every caller waits reset_timeout seconds. Then one probe call
+    goes through: success closes the circuit, failure reopens it. Like
+    RateLimiter, reserve() never sleeps so asyncio callers can await the
+    delay it returns.
+    """
+
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_until = 0.0
+        self.probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.failures < self.failure_threshold:
+            return 'closed'
+        return 'open' if time.monotonic() < self.opened_until else 'half-open'
+
+    def reserve(self):
+        """Return 0 if a call may go ahead now, else seconds to wait before asking again"""
+        with self._lock:
+            if self.failures < self.failure_threshold:
+                return 0.0
+            remaining = self.opened_until - time.monotonic()
+            if remaining > 0:
+                return remaining
+            if self.probing:
+                return PROBE_POLL
+            self.probing = True
+            return 0.0
+
+    def acquire(self, timeout=None):
+        """Block until a call may go ahead; raises CircuitOpenError after timeout seconds"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            delay = self.reserve()
+            if delay <= 0:
+                return
+            if deadline is not None and time.monotonic() + delay > deadline:
+                raise CircuitOpenError(f'Circuit open for another {delay:.1f}s')
+            time.sleep(delay)
+
+    def release(self):
+        """Give back a reservation whose call was abandoned without an answer
+
+        A cancelled or interrupted probe neither closes nor reopens the
+        circuit, but the next caller must be allowed to probe again.
+        """
+        with self._lock:
+            self.probing = False
+
+    def record_success(self):
+        """The API answered; close the circuit"""
+        with self._lock:
+            self.failures = 0
+            self.probing = False
+
+    def record_failure(self):
+        """Count a transient failure, opening the circuit at the threshold"""
+        with self._lock:
+            self.failures += 1
+            self.probing = False
+            if self.failures >= self.failure_threshold:
+                self.opened_until = time.monotonic() + self.reset_timeout
+
+# One breaker per endpoint, shared by every sender in the process
+gmail_breaker = CircuitBreaker()
+oauth_breaker = CircuitBreaker()
+
+class RetryPolicy:
+    """Run calls with classified retries, counting them for the caller
+
+    Transient errors (network, 5xx) are retried with capped exponential
+    backoff and full jitter, throttling honours Retry-After, and permanent
+    errors (other 4xx, revoked tokens) are raised at once. Every attempt
+    first passes the circuit breaker. retries and failures accumulate over
+    all calls, so one policy can be shared by a pool of workers. Set
+    retry_throttled=False when the caller handles throttling itself.
+
+    Retrying a send after a timeout or 5xx can deliver a message twice if
+    Gmail did accept it; pair sends with dedup_index when that matters.
+    """
+
+    def __init__(self, max_retries=MAX_RETRIES, breaker=None, cap=BACKOFF_CAP, retry_throttled=True):
+        self.max_retries = max_retries
+        self.breaker = breaker or gmail_breaker
+        self.cap = cap
+        self.retry_throttled = retry_throttled
+        self.retries = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def record_retry(self):
+        """Count one retry made on this policy's behalf, e.g. by a batch"""
+        with self._lock:
+            self.retries += 1
+        incr('retries')
+
+    def record_failure(self):
+        """Count one call that failed for good"""
+        with self._lock:
+            self.failures += 1
+        incr('failures')
+
+    def call(self, func):
+        """Call func() until it succeeds, fails permanently or runs out of retries"""
+        for attempt in range(self.max_retries + 1):
+            self.breaker.acquire()
+            try:
+                result = func()
+            except Exception as error:
+                kind = classify(error)
+                if kind == TRANSIENT:
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if (kind == PERMANENT or attempt == self.max_retries
+                        or (kind == THROTTLED and not self.retry_throttled)):
+                    self.record_failure()
+                    raise
+                self.record_retry()
+                if kind == THROTTLED:
+                    time.sleep(throttle_delay(error, attempt))
+                else:
+                    time.sleep(backoff_delay(attempt, cap=self.cap))
+                continue
+            except BaseException:
+                self.breaker.release()
+                raise
+
+            self.breaker.record_success()
+            return result
+
+def refresh_credentials(creds, retry=None):
+    """Refresh OAuth credentials, retrying transient token endpoint failures"""
+    retry = retry or RetryPolicy(breaker=oauth_breaker)
+    retry.call(lambda: creds.refresh(Request()))
+    return creds
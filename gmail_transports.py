@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Gmail Transports
+Pluggable delivery backends for create_message output: the Gmail API, pooled
+Gmail SMTP with XOAUTH2, and a local maildir sink for testing
+"""
+
+import base64
+import email.parser
+import email.policy
+import email.utils
+import mailbox
+import os
+import re
+import smtplib
+import ssl
+import threading
+import time
+
+from gmail_metrics import incr
+from gmail_retry import CircuitBreaker, RetryPolicy, refresh_credentials
+
+# Selects the backend open_transport() returns: api, smtp or maildir
+TRANSPORT_ENV = 'GMAIL_TRANSPORT'
+
+SMTP_HOST = 'smtp.gmail.com'
+SMTP_PORT = 587
+
+# XOAUTH2 on smtp.gmail.com only accepts tokens granted this scope; the
+# gmail.send scope the other scripts request is not enough
+SMTP_SCOPE = 'https://mail.google.com/'
+
+# Persistent connections kept open to smtp.gmail.com
+SMTP_POOL_SIZE = 4
+
+# Messages sent on one connection before it is replaced, to stay under
+# Gmail's per-connection limit
+MAX_MESSAGES_PER_CONNECTION = 100
+
+# Connections idle longer than this are checked with NOOP before reuse
+IDLE_CHECK = 30
+
+# Seconds to wait on the SMTP socket
+SMTP_TIMEOUT = 30
+
+# Where MaildirTransport files messages
+MAILDIR_PATH = 'sent_maildir'
+
+# SMTP has its own breaker so an outage there does not stop API sends
+smtp_breaker = CircuitBreaker()
+
+_HEADERS = email.parser.BytesHeaderParser(policy=email.policy.default)
+
+def decode_raw(message):
+    """Return the RFC 822 bytes of a Gmail API {'raw': ...} message"""
+    raw = message['raw']
+    return base64.urlsafe_b64decode(raw + '=' * (-len(raw) % 4))
+
+class GmailApiTransport:
+    """Sends through users.messages.send, as the senders always have
+
+    The service is not thread-safe; give each thread its own transport, or
+    use ConcurrentSender.
+    """
+
+    name = 'api'
+
+    def __init__(self, service, user_id='me', retry=None):
+        self.service = service
+        self.user_id = user_id
+        self.retry = retry or RetryPolicy()
+
+    def send(self, message):
+        return self.retry.call(lambda: self.service.users().messages().send(
+            userId=self.user_id, body=message).execute())
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class SmtpConnection:
+    """One authenticated session in the SmtpTransport pool"""
+
+    def __init__(self, smtp):
+        self.smtp = smtp
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self.smtp.close()
+
+def _message_data(data):
+    """Frame message bytes for DATA: CRLF line ends, dot-stuffing, terminator"""
+    data = re.sub(rb'\r?\n', b'\r\n', data)
+    data = re.sub(rb'(?m)^\.', b'..', data)
+    if not data.endswith(b'\r\n'):
+        data += b'\r\n'
+    return data + b'.\r\n'
+
+def _abort(smtp, data_reply):
+    """Reset the session after a refused MAIL, RCPT or DATA"""
+    if data_reply[0] == 354:
+        # Pipelined DATA was accepted anyway; send an empty body to end it
+        smtp.send(b'.\r\n')
+        smtp.getreply()
+    smtp.rset()
+
+def smtp_transaction(smtp, sender, recipients, data):
+    """Send one message on an open session and return (refused, final reply)
+
+    When the server offers PIPELINING (Gmail does), MAIL, every RCPT and DATA
+    go out in one write, so a message costs two round trips instead of
+    three plus one per recipient. Errors are raised like SMTP.sendmail with
+    the session reset, ready for the next message.
+    """
+    if smtp.has_extn('pipelining'):
+        commands = [f'MAIL FROM:<{sender}>'] + [f'RCPT TO:<{r}>' for r in recipients] + ['DATA']
+        smtp.send(''.join(f'{command}\r\n' for command in commands))
+        mail_reply, *rcpt_replies, data_reply = [smtp.getreply() for _ in commands]
+    else:
+        mail_reply = smtp.mail(sender)
+        rcpt_replies = [smtp.rcpt(r) for r in recipients] if mail_reply[0] == 250 else []
+        if any(code in (250, 251) for code, _ in rcpt_replies):
+            data_reply = smtp.docmd('DATA')
+        else:
+            data_reply = (503, b'No valid recipients')
+
+    if mail_reply[0] != 250:
+        _abort(smtp, data_reply)
+        raise smtplib.SMTPSenderRefused(*mail_reply, sender)
+    refused = {r: reply for r, reply in zip(recipients, rcpt_replies) if reply[0] not in (250, 251)}
+    if len(refused) == len(recipients):
+        _abort(smtp, data_reply)
+        raise smtplib.SMTPRecipientsRefused(refused)
+    if data_reply[0] != 354:
+        _abort(smtp, data_reply)
+        raise smtplib.SMTPDataError(*data_reply)
+
+    smtp.send(_message_data(data))
+    code, reply = smtp.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, reply)
+    return refused, reply
+
+class SmtpTransport:
+    """Sends through smtp.gmail.com over a pool of persistent XOAUTH2 sessions
+
+    Up to pool_size connections are opened on demand, authenticated with the
+    access token from credentials (refreshed as it expires) and reused for
+    up to MAX_MESSAGES_PER_CONNECTION messages each, so bulk sends skip the
+    per-message HTTPS request and JSON encoding. Safe to share between
+    threads: each send checks a connection out of the pool.
+
+    The token must have been granted SMTP_SCOPE. Set starttls=False only for
+    a local test server.
+    """
+
+    name = 'smtp'
+
+    def __init__(self, credentials, sender_email, host=SMTP_HOST, port=SMTP_PORT,
+                 pool_size=SMTP_POOL_SIZE, starttls=True, timeout=SMTP_TIMEOUT, retry=None):
+        self.credentials = credentials
+        self.sender_email = sender_email
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.starttls = starttls
+        self.timeout = timeout
+        self.retry = retry or RetryPolicy(breaker=smtp_breaker)
+        self.connects = 0
+        self.closed = False
+        self._idle = []
+        self._open = 0
+        self._pool = threading.Condition()
+        self._token_lock = threading.Lock()
+
+        scopes = getattr(credentials, 'scopes', None) or getattr(credentials, 'granted_scopes', None)
+        if scopes and SMTP_SCOPE not in scopes:
+            print(f"Warning: token lacks the {SMTP_SCOPE} scope; Gmail SMTP will refuse it")
+
+    def _access_token(self):
+        with self._token_lock:
+            if not self.credentials.valid:
+                refresh_credentials(self.credentials)
+            return self.credentials.token
+
+    def _connect(self):
+        """Open, secure and authenticate a new SMTP session"""
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        try:
+            smtp.ehlo()
+            if self.starttls:
+                smtp.starttls(context=ssl.create_default_context())
+                smtp.ehlo()
+            auth = f'user={self.sender_email}\x01auth=Bearer {self._access_token()}\x01\x01'
+            # On failure Gmail sends a JSON challenge and expects an empty reply
+            smtp.auth('XOAUTH2', lambda challenge=None: auth if challenge is None else '')
+        except BaseException:
+            smtp.close()
+            raise
+        with self._pool:
+            self.connects += 1
+        incr('smtp_connects')
+        return SmtpConnection(smtp)
+
+    def _checkout(self):
+        """Take an idle connection, open a new one, or wait for one to come back"""
+        with self._pool:
+            while not self._idle and self._open >= self.pool_size:
+                self._pool.wait()
+            conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                self._open += 1
+
+        if conn is not None and time.monotonic() - conn.last_used > IDLE_CHECK:
+            try:
+                conn.smtp.noop()
+            except (smtplib.SMTPException, OSError):
+                conn.smtp.close()
+                conn = None
+        if conn is None:
+            try:
+                conn = self._connect()
+            except BaseException:
+                self._discard(None)
+                raise
+        return conn
+
+    def _checkin(self, conn, reusable):
+        if reusable and not self.closed and conn.sent < MAX_MESSAGES_PER_CONNECTION:
+            conn.last_used = time.monotonic()
+            with self._pool:
+                self._idle.append(conn)
+                self._pool.notify()
+        else:
+            self._discard(conn)
+
+    def _discard(self, conn):
+        if conn is not None:
+            conn.close()
+        with self._pool:
+            self._open -= 1
+            self._pool.notify()
+
+    def _deliver(self, sender, recipients, data):
+        conn = self._checkout()
+        reusable = False
+        try:
+            result = smtp_transaction(conn.smtp, sender, recipients, data)
+            conn.sent += 1
+            reusable = True
+            return result
+        except smtplib.SMTPRecipientsRefused:
+            reusable = True
+            raise
+        except smtplib.SMTPResponseException as error:
+            # The server answered and the session was reset, so it is still
+            # good unless the server is closing it (421)
+            reusable = error.smtp_code != 421
+            raise
+        finally:
+            self._checkin(conn, reusable)
+
+    def send(self, message):
+        """Send a create_message() result; returns {'id': ..., 'refused': {...}}"""
+        data = decode_raw(message)
+        headers = _HEADERS.parsebytes(data)
+        addresses = [*headers.get_all('to', []), *headers.get_all('cc', []), *headers.get_all('bcc', [])]
+        recipients = [address for _, address in email.utils.getaddresses(addresses) if address]
+        sender = email.utils.parseaddr(headers.get('from', ''))[1] or self.sender_email
+
+        if 'bcc' in headers:
+            # Bcc goes in the envelope only; the Gmail API strips it the same way
+            full = email.message_from_bytes(data, policy=email.policy.default)
+            del full['bcc']
+            data = full.as_bytes()
+
+        refused, reply = self.retry.call(lambda: self._deliver(sender, recipients, data))
+        return {'id': reply.decode('utf-8', 'replace'), 'refused': refused}
+
+    def close(self):
+        """Quit every idle connection; in-flight ones close when returned"""
+        with self._pool:
+            idle, self._idle = self._idle, []
+            self.closed = True
+        for conn in idle:
+            self._discard(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class MaildirTransport:
+    """Files messages into a local maildir instead of sending them
+
+    For dry runs and tests: nothing leaves the machine, and the result can
+    be read back with mailbox.Maildir or any mail client.
+    """
+
+    name = 'maildir'
+
+    def __init__(self, path=MAILDIR_PATH, retry=None):
+        self.maildir = mailbox.Maildir(path, create=True)
+        self.retry = retry or RetryPolicy()
+
+    def send(self, message):
+        data = decode_raw(message)
+        return {'id': self.retry.call(lambda: self.maildir.add(data))}
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_transport(kind=None, service=None, sender_email=None, token_path='token.json'):
+    """Return the transport named by kind or $GMAIL_TRANSPORT (default api)
+
+    The SMTP transport reads its credentials from token_path; the API
+    transport sends through service.
+    """
+    kind = kind or os.environ.get(TRANSPORT_ENV) or 'api'
+    if kind == 'api':
+        return GmailApiTransport(service)
+    if kind == 'smtp':
+        from google.oauth2.credentials import Credentials
+
+        return SmtpTransport(Credentials.from_authorized_user_file(token_path), sender_email)
+    if kind == 'maildir':
+        return MaildirTransport()
+    raise ValueError(f'Unknown transport {kind!r}; use api, smtp or maildir')
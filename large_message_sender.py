@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Large Message Sender
+Streams MIME messages with attachments to a spooled temp file and sends them
+through the Gmail resumable media upload instead of the raw JSON field
+"""
+
+import base64
+import mimetypes
+import os
+import sys
+import tempfile
+import uuid
+from email.header import Header
+from email.utils import encode_rfc2231
+
+from googleapiclient.http import MediaIoBaseUpload
+
+from email_templates import load_template
+from send_gmail_oauth import authenticate_gmail
+
+# Messages up to this size stay in memory; larger ones spill to disk
+SPOOL_MAX_SIZE = 1024 * 1024
+
+# Attachments are read in multiples of 57 bytes so each base64 line is 76 chars
+READ_SIZE = 57 * 1024
+
+# Upload chunk size; must be a multiple of 256 KB
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+
+def _header(value):
+    """Encode a header value as RFC 2047 when it is not plain ASCII"""
+    try:
+        value.encode('ascii')
+        return value
+    except UnicodeEncodeError:
+        return Header(value, 'utf-8').encode()
+
+def _write_base64(out, stream):
+    """Copy stream to out as base64 lines without loading it into memory"""
+    while True:
+        chunk = stream.read(READ_SIZE)
+        if not chunk:
+            return
+        out.write(base64.encodebytes(chunk))
+
+def write_message(out, sender, recipients, subject, body, attachments=()):
+    """Write a multipart/mixed message with file attachments to a binary stream
+
+    Attachments are paths; each is streamed from disk in fixed-size chunks,
+    so memory use does not grow with attachment size.
+    """
+    boundary = f'==============={uuid.uuid4().hex}=='
+
+    headers = [
+        f'Content-Type: multipart/mixed; boundary="{boundary}"',
+        'MIME-Version: 1.0',
+        f'from: {_header(sender)}',
+        f'to: {_header(", ".join(recipients))}',
+        f'subject: {_header(subject)}',
+    ]
+    out.write(('\n'.join(headers) + '\n\n').encode())
+
+    out.write((
+        f'--{boundary}\n'
+        'Content-Type: text/plain; charset="utf-8"\n'
+        'MIME-Version: 1.0\n'
+        'Content-Transfer-Encoding: base64\n\n').encode())
+    out.write(base64.encodebytes(body.encode('utf-8')))
+
+    for path in attachments:
+        filename = os.path.basename(path)
+        content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        try:
+            filename.encode('ascii')
+            disposition = f'attachment; filename="{filename}"'
+        except UnicodeEncodeError:
+            disposition = f"attachment; filename*={encode_rfc2231(filename, 'utf-8')}"
+
+        out.write((
+            f'--{boundary}\n'
+            f'Content-Type: {content_type}\n'
+            'MIME-Version: 1.0\n'
+            'Content-Transfer-Encoding: base64\n'
+            f'Content-Disposition: {disposition}\n\n').encode())
+        with open(path, 'rb') as f:
+            _write_base64(out, f)
+
+    out.write(f'--{boundary}--\n'.encode())
+
+def create_spooled_message(sender, recipients, subject, body, attachments=()):
+    """Build a message into a SpooledTemporaryFile positioned at the start"""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    write_message(spool, sender, recipients, subject, body, attachments)
+    spool.seek(0)
+    return spool
+
+def send_large_message(service, user_id, spool, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Send a spooled message via resumable media upload"""
+    media = MediaIoBaseUpload(spool, mimetype='message/rfc822',
+                              chunksize=chunk_size, resumable=True)
+    request = service.users().messages().send(userId=user_id, body={}, media_body=media)
+
+    response = None
+    while response is None:
+        status, response = request.next_chunk()
+        if status:
+            print(f'Uploaded {int(status.progress() * 100)}%')
+    return response
+
+def main():
+    # Attachment paths come from the command line
+    attachments = sys.argv[1:]
+    for path in attachments:
+        if not os.path.isfile(path):
+            print(f"ERROR: attachment not found: {path}")
+            return
+
+    # Recipients for FantasyPros API support
+    recipients = ['api@fantasypros.com', 'rodric@fantasypros.com']
+
+    # Read the email content
+    try:
+        content = load_template('fantasypros_api_email.txt').render()
+        subject, body = content.subject, content.body
+    except FileNotFoundError:
+        print("ERROR: fantasypros_api_email.txt not found!")
+        return
+
+    # Authenticate Gmail
+    result = authenticate_gmail()
+    if not result:
+        return
+
+    service, sender_email = result
+    print(f"Authenticated as: {sender_email}")
+
+    with create_spooled_message(sender_email, recipients, subject, body, attachments) as spool:
+        print(f"Sending email with {len(attachments)} attachment(s) to: {', '.join(recipients)}")
+        try:
+            result = send_large_message(service, 'me', spool)
+            print(f'Message sent successfully! Message ID: {result["id"]}')
+        except Exception as error:
+            print(f'An error occurred: {error}')
+
+if __name__ == '__main__':
+    main()
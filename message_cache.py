@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Encode-Once Message Cache
+Serializes and base64-encodes each distinct email body once, so sending it to
+many recipients only encodes their headers
+"""
+
+import base64
+import random
+import sys
+import threading
+from collections import OrderedDict
+from email.message import Message
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from gmail_metrics import incr
+
+# Encoded bodies kept, in bytes of base64 text
+CACHE_BYTES = 32 * 1024 * 1024
+
+# Distinct bodies remembered as seen once; a body is cached on its second
+# use, so personalized one-off bodies do not flush the cache
+SEEN_ENTRIES = 10_000
+
+def _make_boundary(body):
+    while True:
+        boundary = f"{'=' * 15}{random.randrange(sys.maxsize):019d}=="
+        if boundary not in body:
+            return boundary
+
+class EncodedBody:
+    """The MIME body of a message, serialized and base64-encoded once"""
+
+    def __init__(self, body):
+        # Chosen here, like the generator would, so the header block of
+        # every copy can name it
+        self.boundary = _make_boundary(body)
+        message = MIMEMultipart(boundary=self.boundary)
+        message.attach(MIMEText(body, 'plain'))
+        data = message.as_bytes()
+        # Everything after the top-level header block and its blank line
+        self.tail = base64.urlsafe_b64encode(data[data.index(b'\n\n') + 2:]).decode()
+
+def encode_headers(boundary, sender, recipients, subject, headers=None):
+    """Return the base64 header block, padded so the body can be appended as is
+
+    base64 text can only be concatenated at multiples of 3 input bytes, so
+    the header block is followed by up to two empty lines. They land in the
+    multipart preamble, which mail readers ignore.
+    """
+    message = Message()
+    message.add_header('Content-Type', 'multipart/mixed', boundary=boundary)
+    message['MIME-Version'] = '1.0'
+    message['from'] = sender
+    message['to'] = ', '.join(recipients)
+    message['subject'] = subject
+    message.set_payload('')
+
+    # Extra headers such as Reply-To from an email template
+    for name, value in (headers or {}).items():
+        message[name] = value
+
+    data = message.as_bytes()
+    data += b'\n' * (-len(data) % 3)
+    return base64.urlsafe_b64encode(data).decode()
+
+class MessageCache:
+    """LRU cache of EncodedBody by body text, bounded by max_bytes
+
+    Thread-safe; senders share the module-level message_cache.
+    """
+
+    def __init__(self, max_bytes=CACHE_BYTES, seen_entries=SEEN_ENTRIES):
+        self.max_bytes = max_bytes
+        self.seen_entries = seen_entries
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._bodies = OrderedDict()
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def body(self, body):
+        """Return the EncodedBody for body, encoding it on a miss"""
+        with self._lock:
+            encoded = self._bodies.get(body)
+            if encoded is not None:
+                self._bodies.move_to_end(body)
+                self.hits += 1
+            else:
+                self.misses += 1
+                key = hash(body)
+                admit = key in self._seen
+                if not admit:
+                    self._seen[key] = None
+                    if len(self._seen) > self.seen_entries:
+                        self._seen.popitem(last=False)
+        if encoded is not None:
+            incr('message_cache_hits')
+            return encoded
+
+        encoded = EncodedBody(body)
+        if admit:
+            self._store(body, encoded)
+        return encoded
+
+    def _store(self, body, encoded):
+        cost = len(encoded.tail) + len(body)
+        if cost > self.max_bytes:
+            return
+        with self._lock:
+            if body in self._bodies:
+                return
+            self._bodies[body] = encoded
+            self.size += cost
+            while self.size > self.max_bytes:
+                old_body, old = self._bodies.popitem(last=False)
+                self.size -= len(old.tail) + len(old_body)
+
+    def encode(self, sender, recipients, subject, body, headers=None):
+        """Return the Gmail API {'raw': ...} message create_message builds"""
+        encoded = self.body(body)
+        head = encode_headers(encoded.boundary, sender, recipients, subject, headers)
+        return {'raw': head + encoded.tail}
+
+    def clear(self):
+        with self._lock:
+            self._bodies.clear()
+            self._seen.clear()
+            self.size = 0
+
+# Shared by every create_message call in the process
+message_cache = MessageCache()
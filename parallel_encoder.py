@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Parallel Encoder
+Renders and encodes a recipient stream across worker processes, partitioned
+by recipient hash, with bounded queues in both directions
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+import zlib
+
+from dedup_index import message_key
+from message_cache import message_cache
+
+# Worker processes; each one renders and encodes on its own core
+ENCODE_WORKERS = os.cpu_count() or 1
+
+# Rows sent to a worker at once, to keep pickling and queue overhead low
+CHUNK_SIZE = 64
+
+# Chunks that may wait in each worker's input queue, and per worker in the
+# shared output queue; beyond that the reader and the workers block
+QUEUE_CHUNKS = 4
+
+# How often blocked queue operations check for shutdown or a dead worker
+POLL_SECONDS = 0.5
+
+def partition(address, workers):
+    """Return the worker for address; the same recipient always maps to the same one"""
+    return zlib.crc32(address.lower().encode()) % workers
+
+def _encode_worker(template, sender_email, inbox, outbox):
+    """Worker process: render and encode chunks of rows until None arrives
+
+    Each chunk comes back as (encoded, invalid): rows missing a placeholder
+    or that cannot be encoded are only counted.
+    """
+    while (chunk := inbox.get()) is not None:
+        try:
+            encoded = []
+            invalid = 0
+            for row in chunk:
+                try:
+                    content = template.render(row)
+                    digest = message_key([row['email']], content.subject, content.body)
+                    message = message_cache.encode(sender_email, [row['email']], content.subject,
+                                                   content.body, content.headers)
+                except (KeyError, ValueError):
+                    invalid += 1
+                    continue
+                encoded.append((row['email'], digest, message))
+        except Exception as error:
+            outbox.put(error)
+            return
+        outbox.put((encoded, invalid))
+    outbox.put(None)
+
+def parallel_encoded_messages(rows, template, sender_email, workers=ENCODE_WORKERS, chunk_size=CHUNK_SIZE,
+                              stats=None):
+    """Yield (address, digest, message) for rows, encoded by worker processes
+
+    Like recipient_stream.encoded_messages without the dedup check, which
+    the caller does on the results. Rows are read by a feeder thread, dealt
+    to workers by partition(), and results come back as workers finish
+    chunks, so order is only kept per recipient. Workers are started with
+    spawn, which is safe alongside the sender's threads; each pays the
+    import cost once. Rows that cannot be rendered are counted as invalid
+    in stats once the stream is done; any other error in a worker is
+    raised here.
+    """
+    context = multiprocessing.get_context('spawn')
+    inboxes = [context.Queue(maxsize=QUEUE_CHUNKS) for _ in range(workers)]
+    outbox = context.Queue(maxsize=QUEUE_CHUNKS * workers)
+    processes = [
+        context.Process(target=_encode_worker, args=(template, sender_email, inbox, outbox),
+                        name=f'gmail-encoder-{index}', daemon=True)
+        for index, inbox in enumerate(inboxes)
+    ]
+    for process in processes:
+        process.start()
+
+    stop = threading.Event()
+    feed_errors = []
+
+    def put(target, item):
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=POLL_SECONDS)
+                return
+            except queue.Full:
+                continue
+
+    def feed():
+        chunks = [[] for _ in range(workers)]
+        try:
+            for row in rows:
+                index = partition(row['email'], workers)
+                chunks[index].append(row)
+                if len(chunks[index]) >= chunk_size:
+                    put(inboxes[index], chunks[index])
+                    chunks[index] = []
+            for index, chunk in enumerate(chunks):
+                if chunk:
+                    put(inboxes[index], chunk)
+        except Exception as error:
+            feed_errors.append(error)
+        finally:
+            for inbox in inboxes:
+                put(inbox, None)
+
+    feeder = threading.Thread(target=feed, name='encoder-feeder', daemon=True)
+    feeder.start()
+
+    try:
+        finished = 0
+        invalid = 0
+        while finished < workers:
+            try:
+                chunk = outbox.get(timeout=POLL_SECONDS)
+            except queue.Empty:
+                dead = [p.name for p in processes if p.exitcode not in (None, 0)]
+                if dead:
+                    raise RuntimeError(f"Encoder worker {', '.join(dead)} died") from None
+                continue
+            if chunk is None:
+                finished += 1
+            elif isinstance(chunk, Exception):
+                raise chunk
+            else:
+                encoded, chunk_invalid = chunk
+                invalid += chunk_invalid
+                yield from encoded
+
+        # Counted now, once the feeder thread is done updating stats too
+        feeder.join()
+        if stats is not None:
+            stats['invalid'] += invalid
+        if feed_errors:
+            raise feed_errors[0]
+    finally:
+        stop.set()
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+            process.join()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Priority Lanes
+Weighted fair scheduling of sends across transactional, normal and bulk lanes
+sharing one sender and its Gmail quota
+"""
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from gmail_metrics import metrics
+
+# Lane names and their weights: while every lane has work queued, each gets
+# a share of sends proportional to its weight
+LANES = {
+    'transactional': 16,
+    'normal': 4,
+    'bulk': 1,
+}
+
+DEFAULT_LANE = 'normal'
+
+# Recent latencies kept per lane for the percentiles in stats()
+LATENCY_SAMPLES = 1000
+
+class Lane:
+    """Queue and counters of one priority lane"""
+
+    def __init__(self, name, weight):
+        self.name = name
+        self.weight = weight
+        self.queue = deque()
+        # Virtual time of the lane's next send; the lowest goes first
+        self.virtual_time = 0.0
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+
+    def stats(self):
+        """Queue depth, counts and queue-to-done latency in milliseconds"""
+        latencies = sorted(self.latencies)
+
+        def percentile(fraction):
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(fraction * len(latencies)))] * 1000, 1)
+
+        return {'weight': self.weight, 'depth': len(self.queue), 'in_flight': self.in_flight,
+                'sent': self.sent, 'failed': self.failed,
+                'p50_ms': percentile(0.50), 'p95_ms': percentile(0.95), 'p99_ms': percentile(0.99)}
+
+class LaneScheduler:
+    """Feeds a ConcurrentSender from weighted priority lanes
+
+    Messages wait in their lane, not in the sender's executor: only
+    max_in_flight sends (the sender's concurrency by default) are handed
+    over at a time, so a queued password reset is next in line behind at
+    most that many bulk sends, whatever the size of the bulk backlog. Lanes
+    are served by stride scheduling: each send advances its lane's virtual
+    time by 1/weight, and the non-empty lane with the lowest virtual time
+    goes next. A lane that was idle rejoins at the current virtual time
+    rather than with banked credit, and bulk still gets its share, so no
+    lane starves.
+    """
+
+    def __init__(self, sender, lanes=LANES, max_in_flight=None):
+        self.sender = sender
+        self.max_in_flight = max_in_flight or sender.concurrency
+        self.lanes = {name: Lane(name, weight) for name, weight in lanes.items()}
+        self.virtual_time = 0.0
+        self.in_flight = 0
+        self.closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._dispatch, name='gmail-lanes', daemon=True)
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, message, lane=DEFAULT_LANE):
+        """Queue a prepared message in lane and return a Future for the API response"""
+        if lane not in self.lanes:
+            raise ValueError(f"Unknown lane {lane!r}; use {', '.join(self.lanes)}")
+        future = Future()
+        with self._cond:
+            if self.closed:
+                raise RuntimeError('LaneScheduler is closed')
+            target = self.lanes[lane]
+            if not target.queue:
+                target.virtual_time = max(target.virtual_time, self.virtual_time)
+            target.queue.append((message, future, time.monotonic()))
+            self._cond.notify_all()
+        return future
+
+    def _ready(self):
+        return self.in_flight < self.max_in_flight and any(lane.queue for lane in self.lanes.values())
+
+    def _dispatch(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._ready() or (
+                    self.closed and not any(lane.queue for lane in self.lanes.values())))
+                if not self._ready():
+                    return
+                lane = min((lane for lane in self.lanes.values() if lane.queue),
+                           key=lambda lane: lane.virtual_time)
+                self.virtual_time = lane.virtual_time
+                lane.virtual_time += 1 / lane.weight
+                message, future, queued_at = lane.queue.popleft()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.in_flight += 1
+                lane.in_flight += 1
+
+            try:
+                done = self.sender.submit(message)
+            except Exception as error:
+                done = Future()
+                done.set_exception(error)
+            done.add_done_callback(
+                lambda done, lane=lane, future=future, queued_at=queued_at:
+                    self._finish(lane, future, queued_at, done))
+
+    def _finish(self, lane, future, queued_at, done):
+        latency = time.monotonic() - queued_at
+        error = done.exception()
+        with self._cond:
+            self.in_flight -= 1
+            lane.in_flight -= 1
+            if error is None:
+                lane.sent += 1
+            else:
+                lane.failed += 1
+            lane.latencies.append(latency)
+            self._cond.notify_all()
+        metrics.observe(f'lane_{lane.name}', latency, failed=error is not None)
+
+        if error is None:
+            future.set_result(done.result())
+        else:
+            future.set_exception(error)
+
+    def stats(self):
+        """Return {lane: {'depth', 'in_flight', 'sent', 'failed', 'p50_ms', ...}}"""
+        with self._cond:
+            return {name: lane.stats() for name, lane in self.lanes.items()}
+
+    def close(self):
+        """Send everything still queued, then stop the dispatcher"""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+        self._thread.join()
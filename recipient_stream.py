@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Recipient Stream
+Feeds a campaign from CSV or JSONL recipient files through a bounded
+read -> validate -> render -> encode -> send pipeline
+"""
+
+import csv
+import json
+import queue
+import re
+import sys
+import threading
+
+from dedup_index import message_key, open_dedup_index, send_definitely_failed
+from parallel_encoder import parallel_encoded_messages
+
+# Encoded messages waiting to be sent; the reader blocks when this is full
+BUFFER_SIZE = 1000
+
+# Deliberately loose: Gmail rejects anything it cannot deliver anyway
+EMAIL_PATTERN = re.compile(r'^[^@\s,<>]+@[^@\s,<>]+\.[^@\s,<>]+$')
+
+# Marks the end of the stream on the send queue
+_DONE = object()
+
+def read_recipients(path, stats=None):
+    """Yield one dict per recipient row from a .csv or .jsonl file
+
+    CSV files need a header row with an 'email' column. JSONL lines may be
+    objects with an 'email' key or bare address strings. Other columns are
+    kept and become template placeholders. With a stats dict, malformed
+    JSONL lines are counted as invalid and skipped instead of raising.
+    """
+    with open(path, 'r', newline='') as f:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(f)
+            return
+
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                if stats is None:
+                    raise
+                stats['invalid'] += 1
+                continue
+            yield row if isinstance(row, dict) else {'email': row}
+
+def valid_recipients(rows, stats):
+    """Yield rows with a plausible email address, counting the rest in stats"""
+    for row in rows:
+        address = row.get('email')
+        address = address.strip() if isinstance(address, str) else ''
+        if EMAIL_PATTERN.match(address):
+            row['email'] = address
+            yield row
+        else:
+            stats['invalid'] += 1
+
+def encoded_messages(rows, template, sender_email, dedup=None, stats=None):
+    """Render and encode one message per recipient row
+
+    Yields (address, digest, message). Rows that cannot be rendered, such as
+    ones missing a template placeholder, are counted as invalid in stats
+    and skipped. With a dedup index, rows whose rendered email was already
+    claimed are counted as duplicates in stats and skipped before encoding.
+    Nothing is claimed here; the caller claims each message right before
+    sending it.
+    """
+    # Imported here so encoder worker processes, which re-import this
+    # module when it is the main script, never load the Google client
+    from send_gmail_oauth import create_message
+
+    for row in rows:
+        try:
+            content = template.render(row)
+        except KeyError:
+            stats['invalid'] += 1
+            continue
+        digest = message_key([row['email']], content.subject, content.body)
+        if dedup is not None and dedup.status(digest) is not None:
+            stats['duplicate'] += 1
+            continue
+        try:
+            message = create_message(sender_email, [row['email']], content.subject,
+                                     content.body, content.headers)
+        except ValueError:
+            stats['invalid'] += 1
+            continue
+        yield row['email'], digest, message
+
+def unclaimed_messages(items, dedup=None, stats=None):
+    """Drop (address, digest, message) items whose digest dedup already claimed"""
+    for item in items:
+        if dedup is not None and dedup.status(item[1]) is not None:
+            stats['duplicate'] += 1
+            continue
+        yield item
+
+def run_campaign(path, template, sender_email, sender, buffer_size=BUFFER_SIZE, dedup=None, workers=1):
+    """Stream recipients from path and send them through a ConcurrentSender
+
+    A reader thread renders and encodes into a bounded queue while this
+    thread sends, so memory stays flat and sending starts with the first
+    rows. With workers > 1, rendering and encoding run in that many
+    processes (see parallel_encoder); duplicates are then only skipped
+    after encoding. At most sender.concurrency * 2 sends are in flight at
+    once. Bad rows (malformed JSONL, unusable addresses, missing
+    placeholders) are counted as invalid and skipped; only errors reading
+    the file stop the campaign. Pass a dedup_index.DedupIndex to make replays of a campaign skip
+    recipients that were already sent; a message is only claimed right
+    before it is submitted, so stopping a campaign leaves nothing buffered
+    marked as pending. Returns a stats dict with sent, failed, invalid and
+    duplicate counts.
+    """
+    stats = {'sent': 0, 'failed': 0, 'invalid': 0, 'duplicate': 0}
+    pending = queue.Queue(maxsize=buffer_size)
+    reader_errors = []
+
+    def produce():
+        try:
+            rows = valid_recipients(read_recipients(path, stats), stats)
+            if workers > 1:
+                items = unclaimed_messages(
+                    parallel_encoded_messages(rows, template, sender_email, workers, stats=stats),
+                    dedup, stats)
+            else:
+                items = encoded_messages(rows, template, sender_email, dedup, stats)
+            for item in items:
+                pending.put(item)
+        except Exception as error:
+            reader_errors.append(error)
+        finally:
+            pending.put(_DONE)
+
+    reader = threading.Thread(target=produce, name='recipient-reader', daemon=True)
+    reader.start()
+
+    in_flight = threading.BoundedSemaphore(sender.concurrency * 2)
+    stats_lock = threading.Lock()
+
+    def on_done(address, digest, future):
+        try:
+            result = future.result()
+            outcome = 'sent'
+            if dedup is not None:
+                dedup.mark_sent(digest, result.get('id'))
+        except Exception as error:
+            outcome = 'failed'
+            print(f"Message to {address} failed: {error}")
+            if dedup is not None and send_definitely_failed(error):
+                dedup.release(digest)
+        with stats_lock:
+            stats[outcome] += 1
+        in_flight.release()
+
+    # Repeats within this run, which the reader cannot see before they are claimed
+    repeated = 0
+    while True:
+        item = pending.get()
+        if item is _DONE:
+            break
+        address, digest, message = item
+        in_flight.acquire()
+        if dedup is not None and not dedup.claim(digest):
+            in_flight.release()
+            repeated += 1
+            continue
+        try:
+            future = sender.submit(message)
+        except BaseException:
+            if dedup is not None:
+                dedup.release(digest)
+            raise
+        future.add_done_callback(lambda f, address=address, digest=digest: on_done(address, digest, f))
+
+    # Wait for the remaining sends to finish
+    for _ in range(sender.concurrency * 2):
+        in_flight.acquire()
+
+    reader.join()
+    stats['duplicate'] += repeated
+    if reader_errors:
+        raise reader_errors[0]
+    return stats
+
+def main():
+    from automated_gmail_sender import authenticate_gmail_automated
+    from concurrent_gmail_sender import ConcurrentSender
+    from email_templates import load_template
+    from gmail_discovery import build_gmail_service
+    from gmail_rate_limiter import RateLimiter
+    from sender_identity import cached_sender_email
+
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python3 recipient_stream.py recipients.csv|recipients.jsonl [ENCODE_WORKERS]")
+        return
+    workers = int(sys.argv[2]) if len(sys.argv) == 3 else 1
+
+    try:
+        template = load_template('fantasypros_api_email.txt')
+    except FileNotFoundError:
+        print("ERROR: fantasypros_api_email.txt not found!")
+        return
+
+    creds = authenticate_gmail_automated()
+    if not creds:
+        print("Authentication failed")
+        return
+
+    sender_email = cached_sender_email(build_gmail_service(creds), creds)
+    print(f"Authenticated as: {sender_email}")
+
+    with open_dedup_index() as dedup, ConcurrentSender(creds, limiter=RateLimiter()) as sender:
+        stats = run_campaign(sys.argv[1], template, sender_email, sender, dedup=dedup, workers=workers)
+
+    print(f"Done: {stats['sent']} sent, {stats['failed']} failed, "
+          f"{stats['invalid']} invalid address(es) and {stats['duplicate']} already sent skipped")
+
+if __name__ == '__main__':
+    main()
@@ -5,6 +5,7 @@ Provides helpful setup guidance and runs the automated sender
 """
 
 import os
+import runpy
 import sys
 
 def check_setup():
@@ -88,14 +89,43 @@ def main():
         
         return 1
     
-    # All files present, run the automated sender
     print("\n✅ All required files present!")
+
+    # Send through the warm daemon if one is running
+    from gmail_daemon import DaemonError, daemon_available, send_via_daemon
+
+    if daemon_available():
+        from dedup_index import message_key, open_dedup_index, send_once
+        from email_templates import load_template
+
+        print("🔥 Sending through the running gmail_daemon.py...")
+        recipients = ['api@fantasypros.com', 'rodric@fantasypros.com']
+        # The same key automated_gmail_sender.py uses, so either path skips what the other sent
+        content = load_template('fantasypros_api_email.txt').render()
+        digest = message_key(recipients, content.subject, content.body)
+        with open_dedup_index() as dedup:
+            try:
+                result = send_once(
+                    lambda: send_via_daemon(recipients, template='fantasypros_api_email.txt'),
+                    digest, dedup)
+            except DaemonError as e:
+                if dedup is not None and not e.maybe_sent:
+                    dedup.release(digest)
+                print(f"\n❌ Daemon failed to send: {e}")
+                return 1
+        if result is None:
+            print("⏭️  This email was already sent (or may have been), not sending it again")
+            print("   If it never arrived: python3 dedup_index.py --release-pending")
+            return 0
+        print(f"🎉 Email sent! Message ID: {result['id']}")
+        return 0
+
+    # Otherwise run the automated sender in this interpreter
     print("🚀 Running automated_gmail_sender.py...")
     print("=" * 50)
     
-    # Import and run the automated sender
     try:
-        os.system('python3 automated_gmail_sender.py')
+        runpy.run_path('automated_gmail_sender.py', run_name='__main__')
     except KeyboardInterrupt:
         print("\n⏹️  Script interrupted by user")
         return 1
@@ -106,4 +136,7 @@ def main():
     return 0
 
 if __name__ == '__main__':
+    # Fast path for health checks: verify the setup files and exit
+    if '--check' in sys.argv[1:]:
+        sys.exit(1 if check_setup() else 0)
     sys.exit(main())
\ No newline at end of file
@@ -8,7 +8,10 @@ import os
 import base64
 from email.mime.text import MIMEText
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from email_templates import load_template
+from gmail_discovery import build_gmail_service
+from gmail_metrics import phase
+from gmail_retry import RetryPolicy
 
 # Gmail API scope for sending emails
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
@@ -22,11 +25,12 @@ def authenticate_gmail():
     
     try:
         # Load service account credentials
-        credentials = service_account.Credentials.from_service_account_file(
-            'credentials.json', scopes=SCOPES)
+        with phase('load_credentials'):
+            credentials = service_account.Credentials.from_service_account_file(
+                'credentials.json', scopes=SCOPES)
         
         # The service account email will be used as the sender
-        service = build('gmail', 'v1', credentials=credentials)
+        service = build_gmail_service(credentials)
         return service, credentials.service_account_email
         
     except Exception as error:
@@ -41,15 +45,24 @@ def create_message(sender, to, subject, body):
     message['subject'] = subject
     
     # Encode message
-    raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+    with phase('encode'):
+        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
     return {'raw': raw_message}
 
-def send_email(service, user_id, message):
-    """Send email via Gmail API"""
+def send_email(service, user_id, message, retry=None):
+    """Send email via Gmail API
+
+    Transient failures are retried; pass a gmail_retry.RetryPolicy to read
+    back how many retries were needed.
+    """
+    retry = retry or RetryPolicy()
     try:
-        message = service.users().messages().send(userId=user_id, body=message).execute()
-        print(f'Message sent successfully! Message ID: {message["id"]}')
-        return message
+        with phase('send'):
+            result = retry.call(lambda: service.users().messages().send(userId=user_id, body=message).execute())
+        print(f'Message sent successfully! Message ID: {result["id"]}')
+        if retry.retries:
+            print(f'   (after {retry.retries} retries)')
+        return result
     except Exception as error:
         print(f'An error occurred: {error}')
         return None
@@ -57,14 +70,8 @@ def send_email(service, user_id, message):
 def main():
     # Read the email content
     try:
-        with open('fantasypros_api_email.txt', 'r') as f:
-            email_content = f.read()
-        
-        # Extract subject and body
-        lines = email_content.split('\n')
-        subject = lines[0].replace('Subject: ', '')
-        body = '\n'.join(lines[2:])  # Skip subject and empty line
-        
+        content = load_template('fantasypros_api_email.txt').render()
+        subject, body = content.subject, content.body
     except FileNotFoundError:
         print("ERROR: fantasypros_api_email.txt not found!")
         return
@@ -6,14 +6,77 @@ Sends emails using service account credentials with domain-wide delegation
 
 import os
 import base64
+import collections
+import threading
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from email_templates import load_template
+from gmail_discovery import build_gmail_service
+from gmail_metrics import phase
+from gmail_retry import RetryPolicy
 
 # Gmail API scope for sending emails
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
 
+# Delegated identities kept warm at once
+SERVICE_CACHE_SIZE = 1024
+
+class DelegatedServiceCache:
+    """LRU cache of delegated credentials and Gmail services per subject
+    
+    The service account key is read once (and again only if the file
+    changes). Each subject keeps its delegated credentials, so their access
+    token is reused until it expires and only then refreshed, along with a
+    built Gmail service. The least recently used subjects are evicted.
+    """
+    
+    def __init__(self, credentials_path='credentials.json', max_size=SERVICE_CACHE_SIZE):
+        self.credentials_path = credentials_path
+        self.max_size = max_size
+        self._base = None
+        self._base_version = None
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _base_credentials(self):
+        """Return the service account credentials, reloading them if the key file changed"""
+        stat = os.stat(self.credentials_path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version != self._base_version:
+            with phase('load_credentials'):
+                self._base = service_account.Credentials.from_service_account_file(
+                    self.credentials_path, scopes=SCOPES)
+            self._base_version = version
+            self._entries.clear()
+        return self._base
+    
+    def get(self, user_email):
+        """Return (service, delegated_credentials) for user_email"""
+        with self._lock:
+            base = self._base_credentials()
+            entry = self._entries.get(user_email)
+            if entry is not None:
+                self._entries.move_to_end(user_email)
+                return entry
+            
+            delegated_credentials = base.with_subject(user_email)
+            entry = (build_gmail_service(delegated_credentials), delegated_credentials)
+            self._entries[user_email] = entry
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            return entry
+    
+    def invalidate(self, user_email=None):
+        """Forget one subject, or every subject when user_email is None"""
+        with self._lock:
+            if user_email is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_email, None)
+
+delegated_service_cache = DelegatedServiceCache()
+
 def authenticate_gmail_service_account(user_email):
     """Authenticate using service account with domain-wide delegation"""
     if not os.path.exists('credentials.json'):
@@ -21,15 +84,8 @@ def authenticate_gmail_service_account(user_email):
         return None
     
     try:
-        # Load service account credentials
-        credentials = service_account.Credentials.from_service_account_file(
-            'credentials.json', scopes=SCOPES)
-        
-        # Delegate to the user email for domain-wide delegation
-        delegated_credentials = credentials.with_subject(user_email)
-        
-        # Build Gmail service
-        service = build('gmail', 'v1', credentials=delegated_credentials)
+        # Reuse the delegated credentials and service for this user if cached
+        service, _ = delegated_service_cache.get(user_email)
         return service, user_email
         
     except Exception as error:
@@ -48,14 +104,23 @@ def create_message(sender, recipients, subject, body):
     message.attach(MIMEText(body, 'plain'))
     
     # Encode message
-    raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+    with phase('encode'):
+        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
     return {'raw': raw_message}
 
-def send_email(service, user_id, message):
-    """Send email via Gmail API"""
+def send_email(service, user_id, message, retry=None):
+    """Send email via Gmail API
+
+    Transient failures are retried; pass a gmail_retry.RetryPolicy to read
+    back how many retries were needed.
+    """
+    retry = retry or RetryPolicy()
     try:
-        result = service.users().messages().send(userId=user_id, body=message).execute()
+        with phase('send'):
+            result = retry.call(lambda: service.users().messages().send(userId=user_id, body=message).execute())
         print(f'Message sent successfully! Message ID: {result["id"]}')
+        if retry.retries:
+            print(f'   (after {retry.retries} retries)')
         return result
     except Exception as error:
         print(f'An error occurred: {error}')
@@ -70,14 +135,8 @@ def main():
     
     # Read the email content
     try:
-        with open('fantasypros_api_email.txt', 'r') as f:
-            email_content = f.read()
-        
-        # Extract subject and body
-        lines = email_content.split('\n')
-        subject = lines[0].replace('Subject: ', '')
-        body = '\n'.join(lines[2:])  # Skip subject and empty line
-        
+        content = load_template('fantasypros_api_email.txt').render()
+        subject, body = content.subject, content.body
     except FileNotFoundError:
         print("ERROR: fantasypros_api_email.txt not found!")
         return
@@ -90,9 +149,10 @@ def main():
         
         # Try direct service account approach
         try:
-            credentials = service_account.Credentials.from_service_account_file(
-                'credentials.json', scopes=SCOPES)
-            service = build('gmail', 'v1', credentials=credentials)
+            with phase('load_credentials'):
+                credentials = service_account.Credentials.from_service_account_file(
+                    'credentials.json', scopes=SCOPES)
+            service = build_gmail_service(credentials)
             
             # Create and send message
             message = create_message(
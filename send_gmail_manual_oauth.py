@@ -8,10 +8,13 @@ import os
 import base64
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from email_templates import load_template
+from gmail_discovery import build_gmail_service
+from gmail_metrics import phase
+from gmail_retry import RetryPolicy, refresh_credentials
+from sender_identity import cached_sender_email, forget_sender_email, is_identity_error
 
 # Gmail API scope for sending emails
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
@@ -22,12 +25,14 @@ def authenticate_gmail():
 
     # Token file stores the user's access and refresh tokens
     if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+        with phase('load_credentials'):
+            creds = Credentials.from_authorized_user_file('token.json', SCOPES)
 
     # If there are no valid credentials, let user log in
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+            with phase('token_refresh'):
+                refresh_credentials(creds)
         else:
             if not os.path.exists('oauth_credentials.json'):
                 print("ERROR: oauth_credentials.json not found!")
@@ -65,11 +70,10 @@ def authenticate_gmail():
         with open('token.json', 'w') as token:
             token.write(creds.to_json())
 
-    service = build('gmail', 'v1', credentials=creds)
+    service = build_gmail_service(creds)
 
-    # Get user's email address
-    profile = service.users().getProfile(userId='me').execute()
-    sender_email = profile.get('emailAddress')
+    # Get user's email address, cached next to token.json
+    sender_email = cached_sender_email(service, creds)
 
     return service, sender_email
 
@@ -84,17 +88,28 @@ def create_message(sender, recipients, subject, body):
     message.attach(MIMEText(body, 'plain'))
 
     # Encode message
-    raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+    with phase('encode'):
+        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
     return {'raw': raw_message}
 
-def send_email(service, user_id, message):
-    """Send email via Gmail API"""
+def send_email(service, user_id, message, retry=None):
+    """Send email via Gmail API
+
+    Transient failures are retried; pass a gmail_retry.RetryPolicy to read
+    back how many retries were needed.
+    """
+    retry = retry or RetryPolicy()
     try:
-        result = service.users().messages().send(userId=user_id, body=message).execute()
+        with phase('send'):
+            result = retry.call(lambda: service.users().messages().send(userId=user_id, body=message).execute())
         print(f'Message sent successfully! Message ID: {result["id"]}')
+        if retry.retries:
+            print(f'   (after {retry.retries} retries)')
         return result
     except Exception as error:
         print(f'An error occurred: {error}')
+        if is_identity_error(error):
+            forget_sender_email()
         return None
 
 def main():
@@ -103,14 +118,8 @@ def main():
 
     # Read the email content
     try:
-        with open('fantasypros_api_email.txt', 'r') as f:
-            email_content = f.read()
-
-        # Extract subject and body
-        lines = email_content.split('\n')
-        subject = lines[0].replace('Subject: ', '')
-        body = '\n'.join(lines[2:])  # Skip subject and empty line
-
+        content = load_template('fantasypros_api_email.txt').render()
+        subject, body = content.subject, content.body
     except FileNotFoundError:
         print("ERROR: fantasypros_api_email.txt not found!")
         return
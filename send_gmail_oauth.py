@@ -5,13 +5,15 @@ Sends emails using OAuth2 personal Gmail account
 """
 
 import os
-import base64
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from email_templates import load_template
+from gmail_discovery import build_gmail_service
+from gmail_metrics import phase
+from gmail_retry import refresh_credentials
+from gmail_transports import GmailApiTransport, open_transport
+from message_cache import message_cache
+from sender_identity import cached_sender_email, forget_sender_email, is_identity_error
 
 # Gmail API scope for sending emails
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
@@ -22,12 +24,14 @@ def authenticate_gmail():
     
     # Token file stores the user's access and refresh tokens
     if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+        with phase('load_credentials'):
+            creds = Credentials.from_authorized_user_file('token.json', SCOPES)
     
     # If there are no valid credentials, let user log in
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
+            with phase('token_refresh'):
+                refresh_credentials(creds)
         else:
             if not os.path.exists('oauth_credentials.json'):
                 print("ERROR: oauth_credentials.json not found!")
@@ -42,36 +46,41 @@ def authenticate_gmail():
         with open('token.json', 'w') as token:
             token.write(creds.to_json())
     
-    service = build('gmail', 'v1', credentials=creds)
+    service = build_gmail_service(creds)
     
-    # Get user's email address
-    profile = service.users().getProfile(userId='me').execute()
-    sender_email = profile.get('emailAddress')
+    # Get user's email address, cached next to token.json
+    sender_email = cached_sender_email(service, creds)
     
     return service, sender_email
 
-def create_message(sender, recipients, subject, body):
-    """Create email message with multiple recipients"""
-    message = MIMEMultipart()
-    message['from'] = sender
-    message['to'] = ', '.join(recipients)
-    message['subject'] = subject
-    
-    # Add body
-    message.attach(MIMEText(body, 'plain'))
-    
-    # Encode message
-    raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-    return {'raw': raw_message}
+def create_message(sender, recipients, subject, body, headers=None):
+    """Create email message with multiple recipients
+
+    Bodies sent more than once are serialized and encoded only once; see
+    message_cache.
+    """
+    with phase('encode'):
+        return message_cache.encode(sender, recipients, subject, body, headers)
 
-def send_email(service, user_id, message):
-    """Send email via Gmail API"""
+def send_email(service, user_id, message, retry=None, transport=None):
+    """Send email via Gmail API, or through transport when one is given
+
+    Transient failures are retried; pass a gmail_retry.RetryPolicy to read
+    back how many retries were needed. A gmail_transports transport brings
+    its own policy, read back as transport.retry.
+    """
+    transport = transport or GmailApiTransport(service, user_id, retry)
     try:
-        result = service.users().messages().send(userId=user_id, body=message).execute()
+        with phase('send'):
+            result = transport.send(message)
         print(f'Message sent successfully! Message ID: {result["id"]}')
+        if transport.retry.retries:
+            print(f'   (after {transport.retry.retries} retries)')
         return result
     except Exception as error:
         print(f'An error occurred: {error}')
+        if is_identity_error(error):
+            forget_sender_email()
         return None
 
 def main():
@@ -80,14 +89,8 @@ def main():
     
     # Read the email content
     try:
-        with open('fantasypros_api_email.txt', 'r') as f:
-            email_content = f.read()
-        
-        # Extract subject and body
-        lines = email_content.split('\n')
-        subject = lines[0].replace('Subject: ', '')
-        body = '\n'.join(lines[2:])  # Skip subject and empty line
-        
+        content = load_template('fantasypros_api_email.txt').render()
+        subject, body = content.subject, content.body
     except FileNotFoundError:
         print("ERROR: fantasypros_api_email.txt not found!")
         return
@@ -108,8 +111,10 @@ def main():
         body=body
     )
     
+    # GMAIL_TRANSPORT=smtp or maildir sends another way; the default is the API
     print(f"Sending email to: {', '.join(recipients)}")
-    send_email(service, 'me', message)
+    with open_transport(service=service, sender_email=sender_email) as transport:
+        send_email(service, 'me', message, transport=transport)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
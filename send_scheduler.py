@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Send Scheduler
+In-process timer wheel for delayed and recurring sends, persisted in SQLite
+and handing due messages to a sender in batches
+"""
+
+import datetime
+import json
+import signal
+import sqlite3
+import sys
+import threading
+import time
+
+from automated_gmail_sender import authenticate_gmail_automated
+from concurrent_gmail_sender import ConcurrentSender
+from email_templates import load_template
+from gmail_discovery import build_gmail_service
+from gmail_rate_limiter import RateLimiter
+from send_gmail_oauth import create_message
+from sender_identity import cached_sender_email
+
+SCHEDULE_PATH = 'schedule.db'
+
+# Wheel resolution in seconds, and slots in one revolution; the wheel holds
+# what is due within TICK * SLOTS seconds, the rest waits in SQLite
+TICK = 1.0
+SLOTS = 3600
+
+# Most messages handed to the sender at once
+BATCH_SIZE = 100
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS schedule (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    message TEXT NOT NULL,
+    due REAL NOT NULL,
+    every REAL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    runs INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL
+);
+CREATE INDEX IF NOT EXISTS schedule_due ON schedule (status, due);
+"""
+
+class TimerWheel:
+    """Hashed timing wheel of (due, key) entries covering one revolution
+
+    add() is O(1): the entry goes into the slot for its tick. expire() walks
+    the slots between the last tick it saw and now. Entries must be due
+    before horizon(), so every slot only ever holds a single revolution.
+    """
+
+    def __init__(self, tick=TICK, slots=SLOTS, now=None):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.current = int((time.time() if now is None else now) // tick)
+        self.size = 0
+
+    def horizon(self):
+        """Entries must be due before this time"""
+        return (self.current + len(self.slots)) * self.tick
+
+    def add(self, due, key):
+        # Overdue entries go in the current slot and expire on the next call
+        tick = max(int(due // self.tick), self.current)
+        self.slots[tick % len(self.slots)].append((due, key))
+        self.size += 1
+
+    def expire(self, now):
+        """Remove and return the keys of entries due at or before now"""
+        expired = []
+        last = int(now // self.tick)
+        while self.current <= last:
+            slot = self.slots[self.current % len(self.slots)]
+            if self.current < last:
+                expired.extend(key for _, key in slot)
+                slot.clear()
+            else:
+                # The current tick is only partly over
+                expired.extend(key for due, key in slot if due <= now)
+                slot[:] = [(due, key) for due, key in slot if due > now]
+                break
+            self.current += 1
+        self.size -= len(expired)
+        return expired
+
+    def next_expiry(self, now):
+        """Seconds until expire() may return something, at most one tick"""
+        boundary = (int(now // self.tick) + 1) * self.tick
+        slot = self.slots[self.current % len(self.slots)]
+        soonest = min((due for due, _ in slot), default=boundary)
+        return max(0.0, min(soonest, boundary) - now)
+
+class SendScheduler:
+    """Persistent schedule of delayed and recurring sends
+
+    Every entry is a row in SQLite, so the schedule survives restarts and can
+    hold millions of entries. Only the (due, id) pairs due within one wheel
+    revolution are held in memory; they are loaded from the due index as
+    the wheel turns, and rows added by other processes (the add command
+    while run is active) are picked up by ID on every tick. Messages are
+    read back in batches as they expire.
+
+    Delivery is at-least-once: an entry is marked done after its batch was
+    handed over, so a crash in between sends it again on restart. Pair with
+    dedup_index when that matters.
+    """
+
+    def __init__(self, path=SCHEDULE_PATH, tick=TICK, slots=SLOTS):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        self.wheel = TimerWheel(tick, slots)
+        self._lock = threading.Lock()
+        # Rows due before loaded_until with IDs up to max_id are in the
+        # wheel, as are the newer IDs in admitted, scheduled by this process
+        self.loaded_until = float('-inf')
+        self.max_id = 0
+        self.admitted = set()
+        self._load()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _load(self):
+        """Move rows that came within the wheel's horizon, or were added elsewhere, into it"""
+        horizon = self.wheel.horizon()
+        with self._lock:
+            # One read transaction, so both queries see the same rows
+            self.conn.execute('BEGIN')
+            try:
+                last = self.conn.execute('SELECT COALESCE(MAX(id), 0) FROM schedule').fetchone()[0]
+                added = self.conn.execute(
+                    "SELECT id, due FROM schedule WHERE id > ? AND status = 'pending' AND due < ?",
+                    (self.max_id, self.loaded_until)).fetchall()
+                rows = []
+                if horizon > self.loaded_until:
+                    rows = self.conn.execute(
+                        "SELECT id, due FROM schedule WHERE status = 'pending' AND due >= ? AND due < ?",
+                        (self.loaded_until, horizon)).fetchall()
+            finally:
+                self.conn.execute('COMMIT')
+            for row_id, due in added:
+                if row_id not in self.admitted:
+                    self.wheel.add(due, row_id)
+            for row_id, due in rows:
+                self.wheel.add(due, row_id)
+            self.loaded_until = max(self.loaded_until, horizon)
+            self.max_id = last
+            self.admitted.clear()
+
+    def _admit(self, row_id, due):
+        if due < self.loaded_until:
+            self.wheel.add(due, row_id)
+            self.admitted.add(row_id)
+
+    def schedule(self, message, when, every=None, user_id='me'):
+        """Schedule a prepared message for the timestamp when, repeating every seconds"""
+        return self.schedule_many([message], when, every, user_id)[0]
+
+    def schedule_many(self, messages, when, every=None, user_id='me'):
+        """Schedule prepared messages in one transaction and return their IDs"""
+        now = time.time()
+        rows = [(user_id, json.dumps(message), when, every, now) for message in messages]
+        with self._lock, self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            self.conn.executemany(
+                'INSERT INTO schedule (user_id, message, due, every, created_at) VALUES (?, ?, ?, ?, ?)', rows)
+            # One writer inside the transaction, so the new IDs are contiguous
+            last = self.conn.execute('SELECT MAX(id) FROM schedule').fetchone()[0] or 0
+            ids = list(range(last - len(rows) + 1, last + 1))
+            for row_id in ids:
+                self._admit(row_id, when)
+        return ids
+
+    def cancel(self, schedule_id):
+        """Stop a pending entry; returns False if there was none"""
+        with self._lock:
+            cursor = self.conn.execute(
+                "UPDATE schedule SET status = 'cancelled' WHERE id = ? AND status = 'pending'",
+                (schedule_id,))
+        return cursor.rowcount == 1
+
+    def pop_due(self, now=None, batch_size=BATCH_SIZE):
+        """Yield lists of (schedule_id, user_id, message) that are due
+
+        Entries that were cancelled or moved since they entered the wheel
+        are dropped here.
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            keys = list(dict.fromkeys(self.wheel.expire(now)))
+        self._load()
+
+        for start in range(0, len(keys), batch_size):
+            chunk = keys[start:start + batch_size]
+            marks = ','.join('?' * len(chunk))
+            with self._lock:
+                rows = self.conn.execute(
+                    f"SELECT id, user_id, message FROM schedule "
+                    f"WHERE id IN ({marks}) AND status = 'pending' AND due <= ?",
+                    (*chunk, now)).fetchall()
+            if rows:
+                yield [(row_id, user_id, json.loads(message)) for row_id, user_id, message in rows]
+
+    def complete(self, schedule_id, error=None, now=None):
+        """Record a run; recurring entries move to their next slot after now"""
+        now = time.time() if now is None else now
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT due, every FROM schedule WHERE id = ?', (schedule_id,)).fetchone()
+            if row is None:
+                return
+            due, every = row
+            if every:
+                # Skip runs missed while the scheduler was down
+                due += every * max(1, int((now - due) // every) + 1)
+                status = 'pending'
+            else:
+                status = 'failed' if error else 'sent'
+            self.conn.execute(
+                'UPDATE schedule SET due = ?, status = ?, runs = runs + 1, last_error = ?, sent_at = ? '
+                'WHERE id = ?',
+                (due, status, str(error) if error else None, now, schedule_id))
+            if status == 'pending':
+                self._admit(schedule_id, due)
+
+    def run(self, dispatch, stop=None, batch_size=BATCH_SIZE):
+        """Hand due messages to dispatch until stop is set
+
+        dispatch(messages) sends a list of prepared messages and returns
+        (sent, errors) keyed by list index, like ConcurrentSender.send_all
+        and batch_gmail_sender.send_batch. Returns the number sent.
+        """
+        stop = stop or threading.Event()
+        sent_count = 0
+        while not stop.is_set():
+            for batch in self.pop_due(batch_size=batch_size):
+                sent, errors = dispatch([message for _, _, message in batch])
+                for index, (schedule_id, _, _) in enumerate(batch):
+                    self.complete(schedule_id, errors.get(index))
+                sent_count += len(sent)
+            stop.wait(self.wheel.next_expiry(time.time()))
+        return sent_count
+
+    def counts(self):
+        with self._lock:
+            return dict(self.conn.execute(
+                'SELECT status, COUNT(*) FROM schedule GROUP BY status').fetchall())
+
+def main():
+    usage = ("Usage: python3 send_scheduler.py add RECIPIENT YYYY-MM-DDTHH:MM:SS [EVERY_SECONDS]\n"
+             "       python3 send_scheduler.py cancel ID\n"
+             "       python3 send_scheduler.py run\n"
+             "       python3 send_scheduler.py status")
+    args = sys.argv[1:]
+    command = args[0] if args else None
+    if (command not in ('add', 'cancel', 'run', 'status')
+            or (command == 'add' and len(args) < 3) or (command == 'cancel' and len(args) != 2)):
+        print(usage)
+        return 1
+
+    with SendScheduler() as scheduler:
+        if command == 'status':
+            print(f"{SCHEDULE_PATH}: {scheduler.counts()} ({scheduler.wheel.size} due within the hour)")
+            return 0
+        if command == 'cancel':
+            cancelled = scheduler.cancel(int(args[1]))
+            print(f"Cancelled {args[1]}" if cancelled else f"No pending entry {args[1]}")
+            return 0 if cancelled else 1
+
+        creds = authenticate_gmail_automated()
+        if not creds:
+            print("Authentication failed")
+            return 1
+        sender_email = cached_sender_email(build_gmail_service(creds), creds)
+
+        if command == 'add':
+            try:
+                content = load_template('fantasypros_api_email.txt').render({'email': args[1]})
+            except FileNotFoundError:
+                print("ERROR: fantasypros_api_email.txt not found!")
+                return 1
+            message = create_message(sender_email, [args[1]], content.subject, content.body, content.headers)
+            when = datetime.datetime.fromisoformat(args[2]).timestamp()
+            every = float(args[3]) if len(args) > 3 else None
+            schedule_id = scheduler.schedule(message, when, every)
+            print(f"Scheduled {schedule_id} for {args[2]}" + (f", every {every:g}s" if every else ""))
+            return 0
+
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+        print(f"Scheduler running for {sender_email}: {scheduler.counts()}")
+        with ConcurrentSender(creds, limiter=RateLimiter()) as sender:
+            sent = scheduler.run(sender.send_all, stop)
+        print(f"Stopped after sending {sent} message(s): {scheduler.counts()}")
+        return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Sender Identity Cache
+Remembers the authenticated Gmail address next to the token file so sends
+skip the getProfile round trip
+"""
+
+import hashlib
+import json
+import os
+
+from gmail_metrics import incr, phase
+from gmail_retry import RetryPolicy
+
+# Token file the OAuth scripts read and write
+TOKEN_PATH = 'token.json'
+
+# Phrases in Gmail API errors that mean the cached From address is wrong
+IDENTITY_ERROR_MARKERS = ('invalid from', 'delegation denied', 'mail service not enabled')
+
+def identity_path(token_path=TOKEN_PATH):
+    """Return the sidecar file holding the identity for token_path"""
+    root, _ = os.path.splitext(token_path)
+    return f'{root}.identity.json'
+
+def token_fingerprint(creds):
+    """Hash of what identifies the account; stable across access token refreshes"""
+    key = creds.refresh_token or creds.token or ''
+    client_id = getattr(creds, 'client_id', None) or ''
+    return hashlib.sha256(f'{client_id}:{key}'.encode()).hexdigest()
+
+def cached_sender_email(service, creds, token_path=TOKEN_PATH):
+    """Return the sender address for creds, calling getProfile only on a miss
+
+    The address is stored with a fingerprint of the refresh token, so it is
+    looked up again when the token file is replaced by another account's.
+    """
+    path = identity_path(token_path)
+    fingerprint = token_fingerprint(creds)
+    try:
+        with open(path, 'r') as f:
+            identity = json.load(f)
+        if identity.get('fingerprint') == fingerprint and identity.get('email'):
+            incr('identity_cache_hits')
+            return identity['email']
+    except (OSError, ValueError):
+        pass
+
+    with phase('get_profile'):
+        profile = RetryPolicy().call(lambda: service.users().getProfile(userId='me').execute())
+    sender_email = profile.get('emailAddress')
+
+    tmp_path = f'{path}.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            json.dump({'fingerprint': fingerprint, 'email': sender_email}, f)
+        os.replace(tmp_path, path)
+    except OSError as error:
+        print(f'Could not save sender identity: {error}')
+    return sender_email
+
+def forget_sender_email(token_path=TOKEN_PATH):
+    """Drop the cached identity so the next run asks Gmail again"""
+    try:
+        os.remove(identity_path(token_path))
+    except FileNotFoundError:
+        pass
+
+def is_identity_error(error):
+    """Return True if a send failed because the From address is not ours"""
+    resp = getattr(error, 'resp', None)
+    if resp is None or resp.status not in (400, 403):
+        return False
+    content = getattr(error, 'content', b'') or b''
+    text = content.decode('utf-8', 'replace').lower()
+    return any(marker in text for marker in IDENTITY_ERROR_MARKERS)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+"""
+Sender Pool
+Shards sending across several Gmail accounts, routing each message to the
+least-loaded account and failing over when one is throttled or revoked
+"""
+
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+from google.auth.exceptions import RefreshError
+from google.oauth2.credentials import Credentials
+from googleapiclient.errors import HttpError
+
+from email_templates import load_template
+from gmail_discovery import build_gmail_service
+from gmail_retry import RetryPolicy, refresh_credentials
+from gmail_rate_limiter import (
+    QUOTA_UNITS, RateLimiter, backoff_delay, is_rate_limit_error, retry_after_seconds)
+from send_email_service_account import delegated_service_cache
+from send_gmail_oauth import create_message
+from sender_identity import cached_sender_email
+
+# Gmail API scope for sending emails
+SCOPES = ['https://www.googleapis.com/auth/gmail.send']
+
+# Messages per day per account; Google Workspace accounts allow 2000
+DAILY_SEND_LIMIT = 500
+
+# Where per-account daily counts are kept between runs
+POOL_STATE_PATH = 'sender_pool_state.json'
+
+class NoSenderAvailable(Exception):
+    """Every account in the pool is exhausted, cooling down or revoked"""
+
+class SenderAccount:
+    """One sending identity with its own quota and rate limiter"""
+
+    def __init__(self, name, credentials, daily_limit=DAILY_SEND_LIMIT,
+                 service=None, sender_email=None, token_path=None):
+        self.name = name
+        self.credentials = credentials
+        self.daily_limit = daily_limit
+        self.token_path = token_path
+        self.limiter = RateLimiter()
+        self.sent_today = 0
+        self.day = datetime.date.today().isoformat()
+        self.cooldown_until = 0.0
+        self.revoked = False
+        self.in_flight = 0
+        self._service = service
+        self._sender_email = sender_email
+
+    @property
+    def service(self):
+        if self._service is None:
+            self._service = build_gmail_service(self.credentials)
+        return self._service
+
+    @property
+    def sender_email(self):
+        if self._sender_email is None:
+            if self.token_path:
+                self._sender_email = cached_sender_email(self.service, self.credentials, self.token_path)
+            else:
+                profile = self.service.users().getProfile(userId='me').execute()
+                self._sender_email = profile.get('emailAddress')
+        return self._sender_email
+
+    def remaining(self):
+        """Messages this account may still send today"""
+        today = datetime.date.today().isoformat()
+        if today != self.day:
+            self.day = today
+            self.sent_today = 0
+        return self.daily_limit - self.sent_today
+
+    def eligible(self, now):
+        return not self.revoked and now >= self.cooldown_until and self.remaining() > 0
+
+    def load(self):
+        """Fraction of the daily quota used, counting sends in flight"""
+        return (self.sent_today + self.in_flight) / self.daily_limit
+
+class SenderPool:
+    """Route sends to the least-loaded eligible account
+
+    Accounts that Gmail throttles cool down for the Retry-After period (or
+    a backoff) while other accounts take over; accounts whose refresh token
+    is revoked are taken out of rotation. Daily counts are saved to
+    state_path so limits hold across runs. Each account's Gmail service is
+    an httplib2 transport, so call send() from one thread at a time.
+    Transient failures are retried on the same account through self.retry;
+    throttling is left to the failover logic.
+    """
+
+    def __init__(self, accounts, state_path=POOL_STATE_PATH):
+        self.accounts = list(accounts)
+        self.state_path = state_path
+        self.retry = RetryPolicy(retry_throttled=False)
+        self._lock = threading.Lock()
+        self._load_state()
+
+    @classmethod
+    def from_token_files(cls, token_paths, daily_limit=DAILY_SEND_LIMIT, **kwargs):
+        """Build a pool from OAuth token.json-style files"""
+        accounts = [
+            SenderAccount(path, Credentials.from_authorized_user_file(path, SCOPES),
+                          daily_limit, token_path=path)
+            for path in token_paths
+        ]
+        return cls(accounts, **kwargs)
+
+    @classmethod
+    def from_delegated(cls, user_emails, daily_limit=DAILY_SEND_LIMIT, **kwargs):
+        """Build a pool of domain-wide delegated identities from credentials.json"""
+        accounts = []
+        for user_email in user_emails:
+            service, credentials = delegated_service_cache.get(user_email)
+            accounts.append(SenderAccount(user_email, credentials, daily_limit,
+                                          service=service, sender_email=user_email))
+        return cls(accounts, **kwargs)
+
+    def _load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError) as error:
+            print(f'Ignoring unreadable pool state: {error}')
+            return
+        for account in self.accounts:
+            saved = state.get(account.name)
+            if saved and saved.get('day') == account.day:
+                account.sent_today = saved.get('sent', 0)
+
+    def save_state(self):
+        """Persist today's per-account send counts"""
+        if not self.state_path:
+            return
+        with self._lock:
+            state = {account.name: {'day': account.day, 'sent': account.sent_today}
+                     for account in self.accounts}
+        tmp_path = f'{self.state_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _acquire_account(self, exclude):
+        """Pick and reserve the least-loaded eligible account"""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [account for account in self.accounts
+                          if account not in exclude and account.eligible(now)]
+            if not candidates:
+                raise NoSenderAvailable('No sender account is available')
+            account = min(candidates, key=SenderAccount.load)
+            account.in_flight += 1
+            return account
+
+    def _release_account(self, account, sent):
+        with self._lock:
+            account.in_flight -= 1
+            if sent:
+                account.sent_today += 1
+
+    def send(self, recipients, subject, body, headers=None):
+        """Send one message from the best available account
+
+        Returns (account_name, api_response). Raises NoSenderAvailable when
+        every account has been tried, and re-raises errors that another
+        account would not fix.
+        """
+        tried = set()
+        while True:
+            account = self._acquire_account(tried)
+            tried.add(account)
+            sent = False
+            try:
+                message = create_message(account.sender_email, recipients, subject, body, headers)
+                account.limiter.acquire(QUOTA_UNITS['messages.send'])
+                result = self.retry.call(
+                    lambda: account.service.users().messages().send(userId='me', body=message).execute())
+                sent = True
+                account.limiter.on_success()
+                return account.name, result
+            except RefreshError as error:
+                print(f'Sender {account.name} removed from pool: {error}')
+                account.revoked = True
+            except HttpError as error:
+                if not is_rate_limit_error(error):
+                    raise
+                retry_after = retry_after_seconds(error)
+                account.limiter.on_throttle(retry_after)
+                account.cooldown_until = time.monotonic() + (retry_after or backoff_delay(len(tried)))
+                print(f'Sender {account.name} throttled, failing over')
+            finally:
+                self._release_account(account, sent)
+
+    def refresh_tokens(self):
+        """Refresh expired OAuth tokens up front and save them back to their files"""
+        for account in self.accounts:
+            if account.revoked or account.credentials.valid or not account.token_path:
+                continue
+            try:
+                refresh_credentials(account.credentials)
+                with open(account.token_path, 'w') as token:
+                    token.write(account.credentials.to_json())
+            except RefreshError as error:
+                print(f'Sender {account.name} removed from pool: {error}')
+                account.revoked = True
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python3 sender_pool.py token_a.json token_b.json ...")
+        return
+
+    # Recipients for FantasyPros API support, one individual copy each
+    recipients = ['api@fantasypros.com', 'rodric@fantasypros.com']
+
+    try:
+        content = load_template('fantasypros_api_email.txt').render()
+    except FileNotFoundError:
+        print("ERROR: fantasypros_api_email.txt not found!")
+        return
+
+    pool = SenderPool.from_token_files(sys.argv[1:])
+    pool.refresh_tokens()
+
+    try:
+        for recipient in recipients:
+            try:
+                name, result = pool.send([recipient], content.subject, content.body, content.headers)
+                print(f"Message to {recipient} sent from {name}! Message ID: {result['id']}")
+            except NoSenderAvailable:
+                print("All sender accounts are exhausted, throttled or revoked")
+                break
+            except Exception as error:
+                print(f"Message to {recipient} failed: {error}")
+    finally:
+        pool.save_state()
+
+    for account in pool.accounts:
+        status = 'revoked' if account.revoked else f'{account.remaining()} left today'
+        print(f"   {account.name}: {account.sent_today} sent, {status}")
+
+if __name__ == '__main__':
+    main()
@@ -7,9 +7,13 @@ import os
 import base64
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
-from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
+from dedup_index import message_key, open_dedup_index, send_once
+from email_templates import load_template
+from gmail_discovery import build_gmail_service
+from gmail_metrics import phase
+from gmail_retry import RetryPolicy, refresh_credentials
+from sender_identity import cached_sender_email, forget_sender_email, is_identity_error
 
 # Gmail API scope for sending emails
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
@@ -27,12 +31,14 @@ def send_email_with_existing_token():
 
     try:
         # Load existing credentials
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+        with phase('load_credentials'):
+            creds = Credentials.from_authorized_user_file('token.json', SCOPES)
 
         # Refresh if expired
         if creds and creds.expired and creds.refresh_token:
             print("🔄 Refreshing expired token...")
-            creds.refresh(Request())
+            with phase('token_refresh'):
+                refresh_credentials(creds)
 
             # Save refreshed token
             with open('token.json', 'w') as token:
@@ -45,11 +51,10 @@ def send_email_with_existing_token():
             return False
 
         # Build Gmail service
-        service = build('gmail', 'v1', credentials=creds)
+        service = build_gmail_service(creds)
 
-        # Get user info
-        profile = service.users().getProfile(userId='me').execute()
-        sender_email = profile.get('emailAddress')
+        # Sender address, cached next to token.json
+        sender_email = cached_sender_email(service, creds)
         print(f"✅ Authenticated as: {sender_email}")
 
         # Email details
@@ -60,13 +65,8 @@ def send_email_with_existing_token():
             print("❌ Email content file not found: fantasypros_api_email.txt")
             return False
 
-        with open('fantasypros_api_email.txt', 'r') as f:
-            email_content = f.read()
-
-        # Parse content
-        lines = email_content.split('\n')
-        subject = lines[0].replace('Subject: ', '')
-        body = '\n'.join(lines[2:])
+        content = load_template('fantasypros_api_email.txt').render()
+        subject, body = content.subject, content.body
 
         print(f"\n📧 Email Details:")
         print(f"   Subject: {subject}")
@@ -81,14 +81,26 @@ def send_email_with_existing_token():
         message.attach(MIMEText(body, 'plain'))
 
         # Encode and send
-        raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+        with phase('encode'):
+            raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
         email_message = {'raw': raw_message}
 
         print(f"\n🚀 Sending email to FantasyPros...")
-        result = service.users().messages().send(userId='me', body=email_message).execute()
+        retry = RetryPolicy()
+        with open_dedup_index() as dedup, phase('send'):
+            result = send_once(
+                lambda: retry.call(lambda: service.users().messages().send(userId='me', body=email_message).execute()),
+                message_key(recipients, subject, body), dedup)
+
+        if result is None:
+            print(f"\n⏭️  This email was already sent (or may have been), not sending it again")
+            print(f"   If it never arrived: python3 dedup_index.py --release-pending")
+            return True
 
         print(f"\n🎉 EMAIL SENT SUCCESSFULLY!")
         print(f"📝 Message ID: {result['id']}")
+        if retry.retries:
+            print(f"🔁 Retries: {retry.retries}")
         print(f"📧 Sent to: {', '.join(recipients)}")
         print(f"📨 Subject: {subject}")
 
@@ -96,6 +108,8 @@ def send_email_with_existing_token():
 
     except Exception as e:
         print(f"❌ Failed to send email: {e}")
+        if is_identity_error(e):
+            forget_sender_email()
         print("\n🔧 Possible solutions:")
         print("   1. Check internet connection")
         print("   2. Verify token.json is valid")
@@ -113,7 +127,6 @@ def show_manual_setup_instructions():
 
     print("\n2. Find your OAuth client and add redirect URIs:")
     print("   - http://localhost")
-    print("   - http://localhost:8080")
 
     print("\n3. Generate authorization URL manually:")
     print("   Use oauth_credentials.json to create OAuth flow")
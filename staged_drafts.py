@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Staged Drafts
+Two-phase sending for time-critical releases: messages are built, encoded and
+uploaded as drafts ahead of time, then only drafts.send runs at the target time
+"""
+
+import datetime
+import sqlite3
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+from automated_gmail_sender import authenticate_gmail_automated
+from concurrent_gmail_sender import ConcurrentSender
+from email_templates import load_template
+from gmail_discovery import build_gmail_service
+from gmail_rate_limiter import QUOTA_UNITS, RateLimiter
+from recipient_stream import read_recipients, valid_recipients
+from send_gmail_oauth import create_message
+from sender_identity import cached_sender_email
+
+# Drafts need gmail.compose; gmail.send alone cannot create them
+DRAFT_SCOPES = ['https://www.googleapis.com/auth/gmail.compose']
+
+# Kept apart from token.json so the send-only token is left alone
+DRAFTS_TOKEN_PATH = 'token_drafts.json'
+
+DRAFTS_PATH = 'staged_drafts.db'
+
+# Staged drafts older than this are deleted by cleanup
+STALE_DAYS = 7
+
+# wait_until() sleeps until this close to the target, then spins
+SPIN_SECONDS = 0.05
+
+# Draft API calls in flight at once; results are recorded as each one lands
+WINDOW = 64
+
+# Header naming the release on every staged message, so cleanup can tell
+# drafts this script created but never recorded from the user's own
+STAGED_HEADER = 'X-Staged-Release'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS drafts (
+    release TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    draft_id TEXT NOT NULL,
+    recipient TEXT,
+    status TEXT NOT NULL DEFAULT 'staged',
+    message_id TEXT,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    sent_at REAL,
+    PRIMARY KEY (release, position)
+);
+CREATE INDEX IF NOT EXISTS drafts_status ON drafts (status, created_at);
+CREATE INDEX IF NOT EXISTS drafts_id ON drafts (draft_id);
+"""
+
+class DraftStage:
+    """Record of the drafts staged for each release
+
+    A release is a named batch of messages. Every message has a position in
+    it, so staging a release again only creates the drafts still missing,
+    and sending it again only sends the drafts still staged.
+    """
+
+    def __init__(self, path=DRAFTS_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, release, position, draft_id, recipient=None):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO drafts (release, position, draft_id, recipient, created_at) '
+            'VALUES (?, ?, ?, ?, ?)', (release, position, draft_id, recipient, time.time()))
+
+    def positions(self, release):
+        """Return the positions of release that already have a draft"""
+        rows = self.conn.execute('SELECT position FROM drafts WHERE release = ?', (release,))
+        return {position for (position,) in rows}
+
+    def staged(self, release):
+        """Return [(position, draft_id, recipient)] still waiting to be sent, failed ones included"""
+        return self.conn.execute(
+            "SELECT position, draft_id, recipient FROM drafts "
+            "WHERE release = ? AND status IN ('staged', 'failed') ORDER BY position", (release,)).fetchall()
+
+    def known(self, draft_id):
+        """Return True if draft_id was ever recorded"""
+        return self.conn.execute(
+            'SELECT 1 FROM drafts WHERE draft_id = ? LIMIT 1', (draft_id,)).fetchone() is not None
+
+    def mark_sent(self, release, position, message_id):
+        self.conn.execute(
+            "UPDATE drafts SET status = 'sent', message_id = ?, sent_at = ? "
+            "WHERE release = ? AND position = ?", (message_id, time.time(), release, position))
+
+    def mark_failed(self, release, position, error):
+        self.conn.execute(
+            "UPDATE drafts SET status = 'failed', last_error = ? WHERE release = ? AND position = ?",
+            (str(error), release, position))
+
+    def mark_deleted(self, draft_id):
+        self.conn.execute("UPDATE drafts SET status = 'deleted' WHERE draft_id = ?", (draft_id,))
+
+    def stale(self, older_than_days=STALE_DAYS):
+        """Return draft IDs that were staged before the cutoff and never sent"""
+        cutoff = time.time() - older_than_days * 86400
+        rows = self.conn.execute(
+            "SELECT draft_id FROM drafts WHERE status IN ('staged', 'failed') AND created_at < ?",
+            (cutoff,))
+        return [draft_id for (draft_id,) in rows]
+
+    def counts(self, release=None):
+        if release is None:
+            rows = self.conn.execute('SELECT status, COUNT(*) FROM drafts GROUP BY status')
+        else:
+            rows = self.conn.execute(
+                'SELECT status, COUNT(*) FROM drafts WHERE release = ? GROUP BY status', (release,))
+        return dict(rows.fetchall())
+
+def windowed(calls, window=WINDOW):
+    """Run (key, submit) pairs with at most window futures in flight
+
+    submit() starts a call and returns its Future. Yields (key, future) as
+    calls finish, so callers record results while later calls run and
+    memory stays bounded however many calls there are.
+    """
+    in_flight = {}
+    for key, submit in calls:
+        if len(in_flight) >= window:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                yield in_flight.pop(future), future
+        in_flight[submit()] = key
+    while in_flight:
+        finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in finished:
+            yield in_flight.pop(future), future
+
+def stage_drafts(sender, stage, release, messages, window=WINDOW):
+    """Upload (recipient, message) pairs as drafts, skipping positions already staged
+
+    sender is a concurrent_gmail_sender.ConcurrentSender and messages may
+    be any iterable, read once; build them with a STAGED_HEADER naming the
+    release. Draft IDs are recorded as each one comes back, so an
+    interrupted run can simply be repeated; drafts created in the moment it
+    was interrupted are found by delete_stale_drafts. Returns (staged,
+    errors) with errors mapping position to (recipient, exception).
+    """
+    done = stage.positions(release)
+    calls = (
+        ((position, recipient), lambda message=message: sender.submit_request(
+            lambda service: service.users().drafts().create(
+                userId=sender.user_id, body={'message': message}),
+            QUOTA_UNITS['drafts.create']))
+        for position, (recipient, message) in enumerate(messages) if position not in done
+    )
+
+    staged = 0
+    errors = {}
+    for (position, recipient), future in windowed(calls, window):
+        try:
+            draft = future.result()
+        except Exception as error:
+            errors[position] = recipient, error
+            continue
+        stage.record(release, position, draft['id'], recipient)
+        staged += 1
+    return staged, errors
+
+def send_drafts(sender, stage, release, window=WINDOW):
+    """Send every staged draft of release and return (sent, errors)
+
+    Only drafts.send is left to do, so the release is limited by quota and
+    concurrency, not by building or uploading messages. Drafts that failed
+    on an earlier run are tried again; one that did go out is gone from
+    Gmail by then, so it fails with 404 rather than being sent twice.
+    """
+    calls = (
+        (position, lambda draft_id=draft_id: sender.submit_request(
+            lambda service: service.users().drafts().send(
+                userId=sender.user_id, body={'id': draft_id}),
+            QUOTA_UNITS['drafts.send']))
+        for position, draft_id, _ in stage.staged(release)
+    )
+
+    sent = {}
+    errors = {}
+    for position, future in windowed(calls, window):
+        try:
+            sent[position] = future.result()['id']
+        except Exception as error:
+            errors[position] = error
+            stage.mark_failed(release, position, error)
+        else:
+            stage.mark_sent(release, position, sent[position])
+    return sent, errors
+
+def unrecorded_drafts(service, stage, older_than_days=STALE_DAYS):
+    """Return IDs of drafts with a STAGED_HEADER that stage never recorded
+
+    Those are drafts created by a stage run interrupted before it could
+    record them. Only ones older than the cutoff are returned, so a stage
+    run still in progress is left alone; the user's own drafts never carry
+    the header.
+    """
+    cutoff_ms = (time.time() - older_than_days * 86400) * 1000
+    found = []
+    page_token = None
+    while True:
+        response = service.users().drafts().list(userId='me', pageToken=page_token).execute()
+        for draft in response.get('drafts', []):
+            if stage.known(draft['id']):
+                continue
+            message = service.users().drafts().get(
+                userId='me', id=draft['id'], format='metadata').execute().get('message', {})
+            names = {header['name'].lower() for header in message.get('payload', {}).get('headers', [])}
+            if STAGED_HEADER.lower() in names and int(message.get('internalDate', 0)) < cutoff_ms:
+                found.append(draft['id'])
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return found
+
+def delete_stale_drafts(service, stage, older_than_days=STALE_DAYS):
+    """Delete drafts staged long ago and never sent, recorded or not; returns how many went"""
+    deleted = 0
+    for draft_id in stage.stale(older_than_days) + unrecorded_drafts(service, stage, older_than_days):
+        try:
+            service.users().drafts().delete(userId='me', id=draft_id).execute()
+        except Exception as error:
+            # Already gone (sent or deleted by hand) is as good as deleted
+            if getattr(getattr(error, 'resp', None), 'status', None) != 404:
+                print(f"Could not delete draft {draft_id}: {error}")
+                continue
+        stage.mark_deleted(draft_id)
+        deleted += 1
+    return deleted
+
+def wait_until(when):
+    """Sleep until the datetime when, finishing with a short spin for precision"""
+    target = when.timestamp()
+    while (remaining := target - time.time()) > 0:
+        if remaining > SPIN_SECONDS:
+            time.sleep(remaining - SPIN_SECONDS)
+
+def main():
+    usage = ("Usage: python3 staged_drafts.py stage RELEASE recipients.csv|recipients.jsonl\n"
+             "       python3 staged_drafts.py send RELEASE [YYYY-MM-DDTHH:MM:SS]\n"
+             "       python3 staged_drafts.py cleanup [DAYS]\n"
+             "       python3 staged_drafts.py status [RELEASE]")
+    args = sys.argv[1:]
+    command = args[0] if args else None
+    if command not in ('stage', 'send', 'cleanup', 'status') or (command in ('stage', 'send') and len(args) < 2):
+        print(usage)
+        return 1
+
+    with DraftStage() as stage:
+        if command == 'status':
+            print(f"{DRAFTS_PATH}: {stage.counts(args[1] if len(args) > 1 else None)}")
+            return 0
+
+        creds = authenticate_gmail_automated(DRAFTS_TOKEN_PATH, DRAFT_SCOPES)
+        if not creds:
+            print("Authentication failed")
+            return 1
+
+        if command == 'cleanup':
+            days = float(args[1]) if len(args) > 1 else STALE_DAYS
+            deleted = delete_stale_drafts(build_gmail_service(creds), stage, days)
+            print(f"Deleted {deleted} stale draft(s)")
+            return 0
+
+        release = args[1]
+        with ConcurrentSender(creds, limiter=RateLimiter()) as sender:
+            if command == 'stage':
+                try:
+                    template = load_template('fantasypros_api_email.txt')
+                except FileNotFoundError:
+                    print("ERROR: fantasypros_api_email.txt not found!")
+                    return 1
+                sender_email = cached_sender_email(build_gmail_service(creds), creds, DRAFTS_TOKEN_PATH)
+                stats = {'invalid': 0}
+
+                def messages():
+                    for row in valid_recipients(read_recipients(args[2], stats), stats):
+                        try:
+                            content = template.render(row)
+                            headers = dict(content.headers or {}, **{STAGED_HEADER: release})
+                            message = create_message(sender_email, [row['email']], content.subject,
+                                                     content.body, headers)
+                        except (KeyError, ValueError):
+                            stats['invalid'] += 1
+                            continue
+                        yield row['email'], message
+
+                staged, errors = stage_drafts(sender, stage, release, messages())
+                print(f"Staged {staged} draft(s) for {release!r}, {len(errors)} failed, "
+                      f"{stats['invalid']} invalid address(es) skipped")
+                for position, (recipient, error) in sorted(errors.items()):
+                    print(f"   {recipient}: {error}")
+                return 1 if errors else 0
+
+            if len(args) > 2:
+                when = datetime.datetime.fromisoformat(args[2])
+                print(f"Waiting until {when.isoformat()} to send {release!r}...")
+                wait_until(when)
+            start = time.perf_counter()
+            sent, errors = send_drafts(sender, stage, release)
+            print(f"Sent {len(sent)} draft(s) in {time.perf_counter() - start:.2f}s, {len(errors)} failed")
+            return 1 if errors else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
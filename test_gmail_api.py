@@ -6,7 +6,7 @@ Test Gmail API access with service account
 import os
 import json
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from gmail_discovery import build_gmail_service
 
 # Gmail API scopes
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly', 'https://www.googleapis.com/auth/gmail.send']
@@ -19,7 +19,7 @@ def test_gmail_api():
             'credentials.json', scopes=SCOPES)
 
         # Build Gmail service
-        service = build('gmail', 'v1', credentials=credentials)
+        service = build_gmail_service(credentials)
 
         # Try to get user profile
         try: